@@ -1,6 +1,9 @@
 # ai_chat_fix.py
 from dotenv import load_dotenv
 import os
+import hashlib
+import json
+import time
 import google.generativeai as genai
 
 load_dotenv()
@@ -10,24 +13,50 @@ if not api_key:
 
 genai.configure(api_key=api_key)
 
-print(">>> Listing models available for this key (first 50):\n")
-try:
-    models = list(genai.list_models())  # make it a list so we can print length + sample
-    if not models:
-        print("No models returned. This usually means the key/project does not have Generative API access.")
-    else:
-        for i, m in enumerate(models[:50], start=1):
-            # model attribute name differs by SDK, print whole object too if attribute missing
-            model_id = getattr(m, "model", None) or getattr(m, "name", None) or str(m)
-            print(f"{i:02d}. {model_id}")
-except Exception as e:
-    print("Error while listing models:", repr(e))
-    raise SystemExit("Stop - fix list_models error first.")
-
 # If you see a model like 'gemini-2.5-flash' or 'gemini-2.5-pro' below, set it to MODEL.
 # Replace with one from your printed list.
 MODEL = None  # ← after running once, put a supported model string here, e.g. "gemini-2.5-flash"
 
+# {key} is a hash of the API key: model access differs per key/project, and the key itself stays off disk
+MODELS_CACHE_PATH = "~/.ecomagent_models.{key}.json"
+MODELS_CACHE_TTL = 86400  # seconds
+
+
+def _models(cache_path: str = MODELS_CACHE_PATH, ttl: int = MODELS_CACHE_TTL) -> list:
+    """Return model IDs for this key, cached on disk for `ttl` seconds to skip the list_models() RPC"""
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    path = os.path.expanduser(cache_path.format(key=key_hash))
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # model attribute name differs by SDK, print whole object too if attribute missing
+    names = [getattr(m, "model", None) or getattr(m, "name", None) or str(m) for m in genai.list_models()]
+    if names:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(names, f)
+        except OSError:
+            pass
+    return names
+
+
+if MODEL is None:
+    print(">>> Listing models available for this key (first 50):\n")
+    try:
+        models = _models()
+        if not models:
+            print("No models returned. This usually means the key/project does not have Generative API access.")
+        else:
+            for i, model_id in enumerate(models[:50], start=1):
+                print(f"{i:02d}. {model_id}")
+    except Exception as e:
+        print("Error while listing models:", repr(e))
+        raise SystemExit("Stop - fix list_models error first.")
+
 if MODEL:
     try:
         print(f"\n>>> Trying model {MODEL} to generate a short response:")
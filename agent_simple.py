@@ -1,14 +1,404 @@
 from query_engine import IntelligentQueryEngine
 from database import get_db
+from memory import get_conversation_store
+import gemini_client
 from datetime import datetime
-import pandas as pd
+from types import MappingProxyType
+from collections import ChainMap, Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+import atexit
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import re
+import string
+import threading
+import time
 import os
+import weakref
+
+# google.generativeai is slow to import, so it is only loaded once a chatbot has an API key
+_genai = None
+
+
+def _get_genai():
+    """Import google.generativeai on first use; returns None if the SDK is not installed"""
+    global _genai
+    if _genai is None:
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            return None
+        _genai = genai
+    return _genai
+
+
+# .env is only read once, even when every new chatbot finds GOOGLE_API_KEY unset
+_dotenv_loaded = False
+
+
+def _api_key():
+    """GOOGLE_API_KEY from the environment, reading .env at most once per process"""
+    global _dotenv_loaded
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key and not _dotenv_loaded:
+        _dotenv_loaded = True
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except Exception:
+            return None
+        api_key = os.getenv("GOOGLE_API_KEY")
+    return api_key
+
 
 try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except:
-    GEMINI_AVAILABLE = False
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Query result cache (action-observation cache) settings
+QUERY_CACHE_SIZE = 256
+QUERY_CACHE_TTL = 300  # seconds
+
+# Follow-up prefetch settings
+PREFETCH_MAX_PENDING = 6
+# Only follow-ups mentioning something the query engine can answer are prefetched
+_PREFETCHABLE = re.compile(
+    r'\b(categor\w*|revenue|sales|month|monthly|year|trend\w*|region\w*|state\w*|'
+    r'payment|delivery|average|customer\w*|status)\b'
+)
+
+# Most common questions (sidebar quick queries + error-message examples), cached at startup
+_COMMON_QUERIES = (
+    'top selling category',
+    'delivery analysis',
+    'payment methods',
+    'geographic distribution',
+    'order status',
+    'show revenue trends',
+    'average order value',
+    'total revenue',
+)
+# The warm-up fills the query engine's process-wide SQL result cache, so it runs once per process.
+# It is a non-daemon thread: a daemon thread still inside DuckDB at interpreter exit aborts the
+# process, so exit waits for the query in progress and _stop_warmup() skips the rest.
+_warmup_thread = None
+_warmup_stop = threading.Event()
+_warmup_lock = threading.Lock()
+
+
+def _warm_common_queries(engine):
+    """Run _COMMON_QUERIES through engine's silent path until done or _warmup_stop is set"""
+    for q in _COMMON_QUERIES:
+        if _warmup_stop.is_set():
+            return
+        try:
+            engine.run_silent(q)
+        except Exception as e:
+            print(f"⚠️ Cache warm-up failed for '{q}': {e}")
+
+
+def _start_warmup(engine):
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=_warm_common_queries, args=(engine,), name="cache-warmup")
+        _warmup_thread.start()
+
+
+def _stop_warmup():
+    """Skip the remaining warm-up queries and wait for the one in progress"""
+    _warmup_stop.set()
+    thread = _warmup_thread
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+
+atexit.register(_stop_warmup)
+
+# Generation settings for the chatbot's Gemini enrichment call
+GEMINI_GENERATION_CONFIG = {
+    'max_output_tokens': 300,
+    'temperature': 0.7,
+}
+
+# The enrichment prompt asks for at most 100 words; stop streaming once they have arrived
+GEMINI_WORD_BUDGET = 100
+GEMINI_STREAM_TIMEOUT = 30  # seconds; enforced even while waiting on a chunk that never arrives
+
+# Gemini enrichment is cached exactly on (intent, params, data hash). On a miss, a completion for
+# the same data whose *question* embedding is at least this cosine-similar is reused (paraphrases)
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "models/text-embedding-004")
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 256
+
+# Rows rendered in the chat response data table
+MARKDOWN_MAX_ROWS = 20
+
+# Number of recent questions kept in the rolling context window (context['recent_questions'])
+CONTEXT_WINDOW = 5
+
+# In-memory conversation history window; older messages are read back from the conversation store
+HISTORY_MAXLEN = 200
+
+# Translation table that deletes ASCII punctuation
+_NORM_TABLE = str.maketrans('', '', string.punctuation)
+
+
+def _normalize_message(msg: str) -> str:
+    """Normalize a user message into a cache key (lowercase, no punctuation, single spaces)"""
+    # split() with no argument also collapses tabs/newlines, so one translate + join does it all
+    return ' '.join(msg.lower().translate(_NORM_TABLE).split())
+
+
+# Static external knowledge base, shared read-only by every chatbot instance
+_EXTERNAL_KNOWLEDGE = MappingProxyType({
+    'category_descriptions': MappingProxyType({
+        'beleza_saude': '🏥 Beauty & Health - Cosmetics, health products, wellness items',
+        'relogios_presentes': '⌚ Watches & Gifts - Timepieces, gift items, accessories',
+        'cama_mesa_banho': '🛏️ Bedding & Bath - Bed linens, towels, bathroom items',
+        'esporte_lazer': '⚽ Sports & Leisure - Athletic equipment, recreational items',
+        'informatica_acessorios': '💻 IT & Accessories - Computer equipment, tech accessories',
+        'moveis_decoracao': '🪑 Furniture & Decor - Furniture, decorative items',
+        'cool_stuff': '🎯 Cool Stuff - Unique, trendy products',
+        'automotivo': '🚗 Automotive - Car accessories, automotive parts',
+        'ferramentas_jardim': '🔧 Tools & Garden - Tools, garden equipment',
+    }),
+    'business_terms': MappingProxyType({
+        'aov': 'Average Order Value - Total revenue divided by number of orders',
+        'ltv': 'Lifetime Value - Total revenue from a customer over their lifetime',
+        'churn': 'Customer churn - Percentage of customers who stop buying',
+        'conversion': 'Conversion rate - Percentage of visitors who make a purchase',
+    }),
+    'market_insights': MappingProxyType({
+        'beauty_health': 'Beauty & Health is typically the #1 category by revenue',
+        'seasonal': 'Q4 typically shows highest sales due to holiday shopping',
+        'mobile': '70%+ of e-commerce traffic comes from mobile devices',
+        'logistics': 'Average delivery time in Brazil is 7-14 days',
+    })
+})
+
+# Category descriptions pre-formatted as markdown bold for _enrich_response
+_CATEGORY_INSIGHTS = MappingProxyType({
+    category: f"**{desc}**"
+    for category, desc in _EXTERNAL_KNOWLEDGE['category_descriptions'].items()
+})
+
+# Top-3 follow-up suggestions per intent, shared read-only by every chatbot instance
+_FOLLOW_UPS_BY_INTENT = {
+    'top_selling': (
+        "How do these compare month-over-month?",
+        "What's the customer satisfaction for top categories?",
+        "Show geographic distribution of these categories"
+    ),
+    'time_series': (
+        "What's driving the peaks and valleys?",
+        "Any seasonal patterns?",
+        "How does this year compare to last?"
+    ),
+    'average_value': (
+        "How does this vary by region?",
+        "Is this trending up or down?",
+        "What's the price distribution?"
+    ),
+    'delivery_analysis': (
+        "Which regions have fastest delivery?",
+        "Any delivery delays?",
+        "Impact on satisfaction?"
+    ),
+    'geographic': (
+        "Which state spends the most?",
+        "Growth in each region?",
+        "Regional category preferences?"
+    ),
+}
+_DEFAULT_FOLLOW_UPS = (
+    "Want to dig deeper?",
+    "Curious about related metrics?",
+    "Compare across categories?"
+)
+
+
+
+def _build_system_preamble(knowledge: dict) -> str:
+    """
+    Stable prompt prefix shared by every Gemini call in a session.
+    Gemini's implicit prompt caching only applies to an identical leading prefix,
+    so everything that does not change per turn goes here and per-turn content goes after it.
+    """
+    lines = [
+        "You are an e-commerce business analyst for a Brazilian marketplace (Olist dataset).",
+        "",
+        "## Data available",
+        "Tables: orders, order_items, products, customers, payments, sellers, reviews, geolocation, category_names.",
+        "Revenue is the sum of order_items.price in Brazilian reais (R$).",
+        "",
+        "## Reference knowledge",
+    ]
+    for section, entries in knowledge.items():
+        lines.append(f"### {section.replace('_', ' ').title()}")
+        for key, value in entries.items():
+            lines.append(f"- {key}: {value}")
+        lines.append("")
+    lines += [
+        "## Task",
+        "Provide 2-3 CONCISE, ACTIONABLE insights for the query and data in the next message.",
+        "",
+        "Guidelines:",
+        "• Be specific to the data",
+        "• Suggest next actions",
+        "• Maximum 100 words total",
+        "• Use business terminology",
+        "",
+        "Format:",
+        "💡 Insight 1: [insight]",
+        "💡 Insight 2: [insight]",
+        "💡 Insight 3: [insight] (if applicable)",
+    ]
+    return "\n".join(lines)
+
+
+_SYSTEM_PREAMBLE = _build_system_preamble(_EXTERNAL_KNOWLEDGE)
+
+
+def _chunk_text(chunk) -> str:
+    """Text of one streamed Gemini chunk ('' for chunks without text parts, e.g. a final safety chunk)"""
+    try:
+        return chunk.text or ""
+    except ValueError:
+        return ""
+
+
+def _close_stream(response):
+    """Release a streamed Gemini response that was not read to the end (no-op when already finished)"""
+    for target in (response, getattr(response, '_iterator', None)):
+        for name in ('close', 'cancel'):
+            fn = getattr(target, name, None)
+            if callable(fn):
+                try:
+                    fn()
+                except Exception:
+                    pass
+                return
+
+
+# Sync enrichment streams are read here so the caller can stop waiting at GEMINI_STREAM_TIMEOUT
+_stream_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini-stream")
+
+
+def _md_cell(value) -> str:
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def _rows_to_md(rows, headers=None) -> str:
+    """Write rows as a GitHub-style markdown table (no pandas/tabulate needed).
+    Without headers, columns are numbered 0..N-1 like DataFrame(rows).to_markdown().
+    """
+    width = max((len(row) for row in rows), default=0)
+    if headers is None:
+        headers = [str(i) for i in range(width)]
+    lines = [
+        "| " + " | ".join(_md_cell(h) for h in headers) + " |",
+        "|" + "|".join("---" for _ in headers) + "|",
+    ]
+    for row in rows:
+        cells = [_md_cell(v) for v in row] + [""] * (width - len(row))
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=128)
+def _data_to_markdown(data_tuple: tuple) -> str:
+    """Render result rows as a markdown table (memoized on the hashable rows)"""
+    return _rows_to_md(data_tuple)
+
+
+def _rows_to_markdown(data: list) -> str:
+    """Markdown for query result rows, reusing the cached render for repeat result sets.
+    Only the first MARKDOWN_MAX_ROWS rows are rendered; the rest are summarized in a note.
+    """
+    preview = [tuple(row) if isinstance(row, (list, tuple)) else (row,) for row in data[:MARKDOWN_MAX_ROWS]]
+    try:
+        md = _data_to_markdown(tuple(preview))
+    except TypeError:
+        # Unhashable cell values: render without caching
+        md = _rows_to_md(preview)
+    if len(data) > MARKDOWN_MAX_ROWS:
+        md += f"\n\n_…{len(data) - MARKDOWN_MAX_ROWS} more rows omitted_"
+    return md
+
+
+def _data_hash(enriched_response) -> str:
+    """Digest of the full result rows the enrichment prompt is built from"""
+    return hashlib.blake2b(repr(enriched_response.get('data') or ()).encode(), digest_size=16).hexdigest()
+
+
+def _enrichment_key(intent, params: dict, data_hash: str) -> str:
+    """Exact Gemini cache key: same question plan over the same rows -> same completion"""
+    plan = repr((intent, sorted((params or {}).items(), key=lambda kv: kv[0])))
+    return hashlib.blake2b(f"{plan}|{data_hash}".encode(), digest_size=16).hexdigest()
+
+
+# In-flight async Gemini enrichment requests: (event loop, enrichment key) -> Future of the text
+_inflight = {}
+
+
+class _SemanticCache:
+    """Nearest-neighbour cache of (normalized question embedding -> completion text).
+    Every entry carries the data hash it was generated from and only matches that same hash.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, maxsize: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # Ring buffer: rows [:_count] of a preallocated (maxsize, dim) matrix; _next is overwritten first
+        self._matrix = None
+        self._texts = [None] * maxsize
+        self._groups = [None] * maxsize
+        self._group_counts = Counter()
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def has_group(self, group: str) -> bool:
+        """Whether any entry was generated from `group`'s data (callers skip the embedding call if not)"""
+        return self._group_counts[group] > 0
+
+    def lookup(self, vec, group: str):
+        with self._lock:
+            if not self._group_counts[group] or vec.shape[0] != self._matrix.shape[1]:
+                return None
+            sims = self._matrix[:self._count] @ vec
+            mask = np.fromiter((g == group for g in self._groups[:self._count]), dtype=bool, count=self._count)
+            sims[~mask] = -1.0
+            best = int(sims.argmax())
+            if sims[best] >= self.threshold:
+                return self._texts[best]
+            return None
+
+    def add(self, vec, text: str, group: str):
+        with self._lock:
+            if self._matrix is None or vec.shape[0] != self._matrix.shape[1]:
+                # first entry, or the embedding model changed: start over at the new width
+                self._matrix = np.empty((self.maxsize, vec.shape[0]), dtype="float32")
+                self._count = self._next = 0
+                self._groups = [None] * self.maxsize
+                self._group_counts.clear()
+            if self._count == self.maxsize:
+                self._group_counts[self._groups[self._next]] -= 1
+            self._matrix[self._next] = vec
+            self._texts[self._next] = text
+            self._groups[self._next] = group
+            self._group_counts[group] += 1
+            self._next = (self._next + 1) % self.maxsize
+            self._count = min(self._count + 1, self.maxsize)
+
 
 class EnhancedConversationalChatbot:
     """
@@ -22,140 +412,334 @@ class EnhancedConversationalChatbot:
     ✅ FIXED: Proper Gemini enrichment
     """
 
-    def __init__(self):
+    def __init__(self, record_timestamps: bool = True, session_id: str = None):
+        """
+        record_timestamps: batch/eval callers can pass False to skip per-message timestamps.
+        session_id: resume a previous session; its recent history is reloaded from SQLite.
+        """
+        self._record_timestamps = record_timestamps
         self.query_engine = IntelligentQueryEngine()
         self.db = get_db()
-        self.conversation_history = []
-        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
+        self.session_id = session_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.conversation_history = deque(maxlen=HISTORY_MAXLEN)
+        self._overflow_path = f"history_{self.session_id}.jsonl"
+        self._user_msg_count = 0
+        self._assistant_msg_count = 0
+        self._persisted_turn = None
+
+        # SQLite persistence for turns and Gemini responses (optional: chat works without it)
+        try:
+            self._store = get_conversation_store()
+        except Exception as e:
+            print(f"⚠️ Conversation store unavailable: {e}")
+            self._store = None
+
         self.context = {
             'last_query': None,
             'last_category': None,
             'last_metric': None,
             'last_period': None,
-            'questions_asked': [],
+            # bounded: a long session keeps only the last CONTEXT_WINDOW questions
+            'recent_questions': deque(maxlen=CONTEXT_WINDOW),
             'conversation_turns': 0
         }
+        if self._store and session_id:
+            self._reload_history()
 
-        # Initialize Gemini
-        self.gemini_model = None
-        self._init_gemini()
+        # Gemini is configured on first use of .gemini_model (the SDK import and setup cost
+        # is only paid by sessions that actually ask for enrichment)
+        self._gemini_model = None
+        self._gemini_initialized = False
+        self._gemini_init_lock = threading.Lock()
+        self._preamble_in_model = False
         
         # External knowledge base
-        self.external_knowledge = self._init_knowledge_base()
+        self.external_knowledge = _EXTERNAL_KNOWLEDGE
+        self._system_preamble = _SYSTEM_PREAMBLE
+
+        # Exact (intent, params, data hash) cache in front of the Gemini enrichment call, backed by
+        # SQLite; the paraphrase fallback needs numpy + Gemini embeddings
+        self._gemini_exact = OrderedDict()
+        self._gemini_cache = _SemanticCache() if HAS_NUMPY else None
+
+        # LRU + TTL cache of query_engine results keyed by normalized message
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+        # Background prefetch of likely follow-up questions into the query cache
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        # Shut the workers down when the chatbot is garbage-collected even if close() is never called
+        self._prefetch_finalizer = weakref.finalize(self, self._prefetch_pool.shutdown, wait=False)
+        self._prefetch_pending = deque()
+        self._prefetched_keys = set()
+        self.prefetch_stats = {'submitted': 0, 'hits': 0}
+
+        # Pre-warm the SQL result cache (first chatbot in the process only) so the most
+        # likely first questions skip the database
+        _start_warmup(self.query_engine)
+
+    def _reload_history(self):
+        """Restore the in-memory history window and turn counter of a resumed session"""
+        try:
+            messages = self._store.recent_messages(self.session_id, HISTORY_MAXLEN)
+            last_turn = self._store.last_turn(self.session_id)
+        except Exception as e:
+            print(f"⚠️ Could not reload history for session {self.session_id}: {e}")
+            return
+        for msg in messages:
+            self._append_history(msg)
+        # new turns continue the numbering instead of reusing stored turn numbers
+        self.context['conversation_turns'] = last_turn
+
+    @property
+    def gemini_model(self):
+        """Gemini model, set up on first access; None when no API key or SDK is available"""
+        if not self._gemini_initialized:
+            with self._gemini_init_lock:
+                if not self._gemini_initialized:
+                    self._init_gemini()
+                    self._gemini_initialized = True
+        return self._gemini_model
 
     def _init_gemini(self):
         """Initialize Gemini with error handling"""
-        if GEMINI_AVAILABLE:
-            try:
-                api_key = os.getenv("GOOGLE_API_KEY")
-                if not api_key:
-                    try:
-                        from dotenv import load_dotenv
-                        load_dotenv()
-                        api_key = os.getenv("GOOGLE_API_KEY")
-                    except:
-                        pass
-
-                if api_key:
-                    genai.configure(api_key=api_key)
-                    self.gemini_model = genai.GenerativeModel('gemini-1.5-pro')
-            except Exception as e:
-                print(f"⚠️ Gemini init failed: {e}")
-
-    def _init_knowledge_base(self) -> dict:
-        """Initialize external knowledge base"""
-        return {
-            'category_descriptions': {
-                'beleza_saude': '🏥 Beauty & Health - Cosmetics, health products, wellness items',
-                'relogios_presentes': '⌚ Watches & Gifts - Timepieces, gift items, accessories',
-                'cama_mesa_banho': '🛏️ Bedding & Bath - Bed linens, towels, bathroom items',
-                'esporte_lazer': '⚽ Sports & Leisure - Athletic equipment, recreational items',
-                'informatica_acessorios': '💻 IT & Accessories - Computer equipment, tech accessories',
-                'moveis_decoracao': '🪑 Furniture & Decor - Furniture, decorative items',
-                'cool_stuff': '🎯 Cool Stuff - Unique, trendy products',
-                'automotivo': '🚗 Automotive - Car accessories, automotive parts',
-                'ferramentas_jardim': '🔧 Tools & Garden - Tools, garden equipment',
-            },
-            'business_terms': {
-                'aov': 'Average Order Value - Total revenue divided by number of orders',
-                'ltv': 'Lifetime Value - Total revenue from a customer over their lifetime',
-                'churn': 'Customer churn - Percentage of customers who stop buying',
-                'conversion': 'Conversion rate - Percentage of visitors who make a purchase',
-            },
-            'market_insights': {
-                'beauty_health': 'Beauty & Health is typically the #1 category by revenue',
-                'seasonal': 'Q4 typically shows highest sales due to holiday shopping',
-                'mobile': '70%+ of e-commerce traffic comes from mobile devices',
-                'logistics': 'Average delivery time in Brazil is 7-14 days',
-            }
-        }
+        try:
+            api_key = _api_key()
+            genai = _get_genai() if api_key else None
+            if genai:
+                genai.configure(api_key=api_key)
+                # Static analyst instructions go in system_instruction so per-turn
+                # requests only carry the variable part of the prompt
+                try:
+                    self._gemini_model = genai.GenerativeModel(
+                        'gemini-1.5-pro', system_instruction=_SYSTEM_PREAMBLE
+                    )
+                    self._preamble_in_model = True
+                except TypeError:
+                    # Older SDKs without system_instruction: send the preamble as the first part
+                    self._gemini_model = genai.GenerativeModel('gemini-1.5-pro')
+        except Exception as e:
+            print(f"⚠️ Gemini init failed: {e}")
 
     def chat(self, user_message: str) -> dict:
         """
         Process user message with full context awareness
         FIXED: Proper Gemini integration for enriched responses
         """
-        
+        ts = self._begin_turn(user_message)
+
+        try:
+            # 1. Classify + query in one pass (served from cache on repeats)
+            user_intent, user_params, query_result = self._cached_query(user_message)
+
+            # 2. Update context
+            self._update_context(user_params)
+
+            # 3. Enrich with external knowledge
+            enriched_response = self._enrich_response(query_result, user_intent, user_params)
+
+            # 4. Get Gemini insights - FIXED
+            gemini_analysis = self._get_gemini_enrichment(user_message, enriched_response, user_intent, user_params)
+
+            # 5. Format final response
+            response = self._format_response_with_gemini(enriched_response, gemini_analysis)
+
+            return self._finish_turn(user_message, user_intent, user_params, enriched_response,
+                                     response, gemini_analysis, ts)
+
+        except Exception as e:
+            return self._fail_turn(user_message, str(e), ts)
+
+    async def achat(self, user_message: str) -> dict:
+        """
+        Async variant of chat(): the database query runs in an executor, and the
+        Gemini call runs concurrently with the data-table render (they only share the query result)
+        """
+        ts = self._begin_turn(user_message)
+        loop = asyncio.get_running_loop()
+
+        try:
+            user_intent, user_params, query_result = await loop.run_in_executor(
+                None, self._cached_query, user_message
+            )
+            self._update_context(user_params)
+            enriched_response = self._enrich_response(query_result, user_intent, user_params)
+
+            gemini_analysis, data_table = await asyncio.gather(
+                self._get_gemini_enrichment_async(user_message, enriched_response, user_intent, user_params),
+                loop.run_in_executor(None, self._render_data_table, enriched_response),
+            )
+            response = self._format_response_with_gemini(enriched_response, gemini_analysis, data_table)
+
+            return self._finish_turn(user_message, user_intent, user_params, enriched_response,
+                                     response, gemini_analysis, ts)
+
+        except Exception as e:
+            return self._fail_turn(user_message, str(e), ts)
+
+    def _begin_turn(self, user_message: str) -> str:
+        """Record the user message and update per-turn context; returns the turn timestamp (or None)"""
+        # One timestamp per turn, shared by the user and assistant entries
+        ts = datetime.now().isoformat() if self._record_timestamps else None
+
         # Add to history
-        self.conversation_history.append({
+        self._append_history({
             'role': 'user',
             'content': user_message,
-            'timestamp': datetime.now().isoformat()
-        })
+        }, ts)
 
         # Update context
-        self.context['questions_asked'].append(user_message)
+        self.context['recent_questions'].append(user_message)
         self.context['conversation_turns'] += 1
+        return ts
 
-        try:
-            # 1. Analyze user message
-            user_intent = self.query_engine._classify_intent(user_message)
-            user_params = self.query_engine._extract_parameters(user_message)
+    def _update_context(self, params: dict):
+        """Remember the dimension/metric the user is asking about"""
+        if params.get('dimension') == 'category':
+            self.context['last_category'] = params.get('dimension')
+        if params.get('metric'):
+            self.context['last_metric'] = params['metric']
 
-            # 2. Update context
-            if user_params.get('dimension') == 'category':
-                self.context['last_category'] = user_params.get('dimension')
-            if user_params.get('metric'):
-                self.context['last_metric'] = user_params['metric']
+    def _finish_turn(self, user_message: str, intent: str, params: dict, enriched_response: dict,
+                     response: str, gemini_analysis: str, ts: str) -> dict:
+        """Generate follow-ups, record the assistant message and build the chat() return value"""
+        follow_ups = self._get_intelligent_follow_ups(intent, params, enriched_response)
 
-            # 3. Get query results
-            query_result = self.query_engine.query(user_message)
+        final_response = {
+            'status': 'success',
+            'query_asked': user_message,
+            'response': response,
+            'gemini_insights': gemini_analysis,
+            'follow_ups': follow_ups,
+            # Read-only live view; callers wanting a snapshot can dict() it
+            'context': MappingProxyType(self.context)
+        }
 
-            # 4. Enrich with external knowledge
-            enriched_response = self._enrich_response(query_result, user_intent, user_params)
+        # Add to history
+        assistant_entry = {
+            'role': 'assistant',
+            'content': response,
+            'gemini_insights': gemini_analysis,
+            'follow_ups': follow_ups,
+        }
+        self._append_history(assistant_entry, ts)
+        user_entry = {'role': 'user', 'content': user_message}
+        if ts is not None:
+            user_entry['timestamp'] = ts
+        self._persist_turn([user_entry, assistant_entry])
 
-            # 5. Get Gemini insights - FIXED
-            gemini_analysis = self._get_gemini_enrichment(user_message, enriched_response)
+        # Warm the cache for the follow-ups the user is likely to click
+        self._prefetch_follow_ups(follow_ups)
 
-            # 6. Format final response
-            response = self._format_response_with_gemini(enriched_response, gemini_analysis)
+        return final_response
 
-            # 7. Generate follow-ups
-            follow_ups = self._get_intelligent_follow_ups(user_intent, user_params, enriched_response)
-
-            final_response = {
-                'status': 'success',
-                'query_asked': user_message,
-                'response': response,
-                'gemini_insights': gemini_analysis,
-                'follow_ups': follow_ups,
-                'context': dict(self.context)
-            }
-
-            # Add to history
-            self.conversation_history.append({
-                'role': 'assistant',
-                'content': response,
-                'gemini_insights': gemini_analysis,
-                'follow_ups': follow_ups,
-                'timestamp': datetime.now().isoformat()
-            })
-
-            return final_response
+    def _fail_turn(self, user_message: str, error: str, ts: str) -> dict:
+        """Error path of chat()/achat(): the user message already in history is persisted too,
+        so a resumed session sees the same turns as the live one"""
+        if self._persisted_turn != self.context['conversation_turns']:
+            user_entry = {'role': 'user', 'content': user_message}
+            if ts is not None:
+                user_entry['timestamp'] = ts
+            self._persist_turn([user_entry])
+        return self._handle_error(error, user_message)
 
+    def _persist_turn(self, messages: list):
+        """Write this turn's user + assistant messages to SQLite in one transaction"""
+        # the turn counts as persisted even if the write fails, so _fail_turn never writes it twice
+        self._persisted_turn = self.context['conversation_turns']
+        if not self._store:
+            return
+        try:
+            self._store.add_turn(self.session_id, self.context['conversation_turns'], messages)
         except Exception as e:
-            return self._handle_error(str(e), user_message)
+            print(f"⚠️ Could not persist turn: {e}")
+
+    def _append_history(self, entry: dict, ts: str = None):
+        """Append to the bounded history. Evicted messages are already in SQLite (_persist_turn);
+        only without a conversation store are they spilled to a JSONL file instead.
+        """
+        if ts is not None:
+            entry['timestamp'] = ts
+        if self._store is None and len(self.conversation_history) == self.conversation_history.maxlen:
+            evicted = self.conversation_history[0]
+            try:
+                with open(self._overflow_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(evicted, default=str) + '\n')
+            except OSError as e:
+                print(f"⚠️ Could not spill history to {self._overflow_path}: {e}")
+        self.conversation_history.append(entry)
+        if entry['role'] == 'user':
+            self._user_msg_count += 1
+        else:
+            self._assistant_msg_count += 1
+
+    def close(self):
+        """Stop the prefetch workers and the startup warm-up; pending prefetches are cancelled"""
+        while self._prefetch_pending:
+            self._prefetch_pending.popleft().cancel()
+        self._prefetch_finalizer()
+        _stop_warmup()
+
+    def _cached_query(self, user_message: str, record: bool = True) -> tuple:
+        """Run query_engine.query_with_intent() through a per-session LRU cache with TTL.
+        record=False (prefetch/warm-up) uses the engine's silent path so speculative queries
+        never show up in its conversation_history.
+        """
+        key = _normalize_message(user_message)
+        now = time.monotonic()
+        with self._query_cache_lock:
+            entry = self._query_cache.get(key)
+            if entry is not None:
+                stored_at, cached_result = entry
+                if now - stored_at < QUERY_CACHE_TTL:
+                    self._query_cache.move_to_end(key)
+                    if key in self._prefetched_keys:
+                        self._prefetched_keys.discard(key)
+                        self.prefetch_stats['hits'] += 1
+                    if record:
+                        self.query_engine.record_query(self.query_engine._clean_query(user_message))
+                    return copy.deepcopy(cached_result)
+                del self._query_cache[key]
+
+        if record:
+            intent, params, query_result = self.query_engine.query_with_intent(user_message)
+        else:
+            intent, params, query_result = self.query_engine.run_silent(user_message)
+        cached = (intent, params, query_result)
+
+        # Only cache successful lookups so transient DB errors are retried
+        if query_result.get('status') == 'success':
+            with self._query_cache_lock:
+                self._query_cache[key] = (now, copy.deepcopy(cached))
+                self._query_cache.move_to_end(key)
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        return cached
+
+    def _prefetch_follow_ups(self, follow_ups: tuple):
+        """Speculatively run queryable follow-ups on a background thread"""
+        # Drop futures that already finished and cancel stale ones beyond the window
+        while self._prefetch_pending and self._prefetch_pending[0].done():
+            self._prefetch_pending.popleft()
+        while len(self._prefetch_pending) >= PREFETCH_MAX_PENDING:
+            self._prefetch_pending.popleft().cancel()
+
+        for suggestion in follow_ups:
+            key = _normalize_message(suggestion)
+            if not _PREFETCHABLE.search(key):
+                continue
+            with self._query_cache_lock:
+                if key in self._query_cache:
+                    continue
+                self._prefetched_keys.add(key)
+            self.prefetch_stats['submitted'] += 1
+            self._prefetch_pending.append(self._prefetch_pool.submit(self._cached_query, suggestion, False))
+
+    def clear_query_cache(self):
+        """Invalidate cached query results (call after the database is reloaded)"""
+        with self._query_cache_lock:
+            self._query_cache.clear()
+            self._prefetched_keys.clear()
 
     def _enrich_response(self, query_result: dict, intent: str, params: dict) -> dict:
         """Enrich query results with external knowledge"""
@@ -163,18 +747,16 @@ class EnhancedConversationalChatbot:
         if query_result['status'] != 'success':
             return query_result
 
-        enriched = query_result.copy()
+        # Overlay: enrichment keys land in the front map and query_result itself is never touched
+        enriched = ChainMap({}, query_result)
 
         # Add category descriptions
         if intent in ['grouping', 'top_selling'] and query_result.get('data'):
-            descriptions = []
-            for row in query_result['data'][:3]:
-                category = row[0]
-                desc = self.external_knowledge['category_descriptions'].get(
-                    category, f"Category: {category}"
-                )
-                descriptions.append(f"**{desc}**")
-            enriched['category_insights'] = descriptions
+            descs_map = _CATEGORY_INSIGHTS
+            enriched['category_insights'] = [
+                descs_map.get(row[0]) or f"**Category: {row[0]}**"
+                for row in query_result['data'][:3]
+            ]
 
         # Add market insights
         if 'revenue' in query_result.get('analysis', '').lower():
@@ -182,7 +764,7 @@ class EnhancedConversationalChatbot:
 
         return enriched
 
-    def _get_gemini_enrichment(self, query: str, enriched_response: dict) -> str:
+    def _get_gemini_enrichment(self, query: str, enriched_response: dict, intent=None, params=None) -> str:
         """
         Get Gemini AI enrichment for the response
         FIXED: Proper prompt engineering and error handling
@@ -192,164 +774,292 @@ class EnhancedConversationalChatbot:
             return "💡 *Gemini insights unavailable*"
 
         try:
-            # Build context from enriched response
-            analysis = enriched_response.get('analysis', '')
-            data = enriched_response.get('data', [])[:5]
-            
-            # Format data summary
-            data_summary = "Data rows:\n"
-            if data:
-                for row in data:
-                    data_summary += f"• {row}\n"
+            data_hash = _data_hash(enriched_response)
+            key = _enrichment_key(intent, params, data_hash)
+            cached = self._cached_enrichment(key) or self._similar_enrichment(query, data_hash)
+            if cached:
+                return cached
+            prompt = self._build_turn_prompt(query, enriched_response)
 
-            prompt = f"""You are an e-commerce business analyst. Provide 2-3 CONCISE, ACTIONABLE insights.
+            # Stream on a worker and stop once the prompt's 100-word budget has arrived; the
+            # future timeout bounds the whole request even if the server stalls mid-stream
+            parts, stop = [], threading.Event()
+            stream = _stream_pool.submit(self._read_enrichment_stream, self._build_gemini_contents(prompt), parts, stop)
+            try:
+                stream.result(timeout=GEMINI_STREAM_TIMEOUT)
+            except FutureTimeoutError:
+                stop.set()
+                # partial text is shown but not cached
+                return self._gemini_text("".join(list(parts)))
+            return self._gemini_cache_store(key, data_hash, query, prompt, self._gemini_text("".join(parts)))
+        except Exception as e:
+            return self._gemini_error_text(e)
 
-Query: {query}
+    def _read_enrichment_stream(self, contents: list, parts: list, stop: threading.Event):
+        """Append streamed chunk texts to `parts` until the word budget, the end, or `stop` is set"""
+        if stop.is_set():
+            # queued in _stream_pool past the caller's timeout: don't spend a request on it
+            return
+        response = self.gemini_model.generate_content(
+            contents,
+            generation_config=GEMINI_GENERATION_CONFIG,
+            stream=True
+        )
+        words = 0
+        try:
+            for chunk in response:
+                if stop.is_set():
+                    break
+                piece = _chunk_text(chunk)
+                parts.append(piece)
+                words += len(piece.split())
+                if words >= GEMINI_WORD_BUDGET:
+                    break
+        finally:
+            _close_stream(response)
 
-Current Analysis:
-{analysis[:300]}
+    async def _get_gemini_enrichment_async(self, query: str, enriched_response: dict,
+                                           intent=None, params=None) -> str:
+        """Non-blocking variant of _get_gemini_enrichment(), rate-limited through gemini_client.
+        Concurrent calls with an identical prompt share one request (single-flight).
+        """
+        if not self.gemini_model:
+            return "💡 *Gemini insights unavailable*"
+
+        data_hash = _data_hash(enriched_response)
+        cache_key = _enrichment_key(intent, params, data_hash)
+        loop = asyncio.get_running_loop()
+        key = (loop, cache_key)
+        pending = _inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = loop.create_future()
+        _inflight[key] = future
+        try:
+            text = await self._generate_enrichment_async(query, enriched_response, cache_key, data_hash)
+            future.set_result(text)
+            return text
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            _inflight.pop(key, None)
+
+    async def _generate_enrichment_async(self, query: str, enriched_response: dict,
+                                         key: str, data_hash: str) -> str:
+        try:
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(None, self._cached_enrichment, key)
+            if not cached and self._gemini_cache is not None and self._gemini_cache.has_group(data_hash):
+                cached = await loop.run_in_executor(None, self._similar_enrichment, query, data_hash)
+            if cached:
+                return cached
+            prompt = self._build_turn_prompt(query, enriched_response)
 
-{data_summary}
-
-Guidelines:
-• Be specific to the data
-• Suggest next actions
-• Maximum 100 words total
-• Use business terminology
-
-Format:
-💡 Insight 1: [insight]
-💡 Insight 2: [insight]
-💡 Insight 3: [insight] (if applicable)"""
-
-            response = self.gemini_model.generate_content(
-                prompt,
-                generation_config={
-                    'max_output_tokens': 300,
-                    'temperature': 0.7,
-                }
+            response = await gemini_client.submit(
+                self.gemini_model,
+                self._build_gemini_contents(prompt),
+                generation_config=GEMINI_GENERATION_CONFIG,
+                stream=True
             )
+            parts = []
 
-            if response and response.text:
-                text = response.text.strip()
-                if len(text) > 20:
-                    return f"🧠 **AI Analysis:**\n{text}"
+            async def read():
+                words = 0
+                try:
+                    async for chunk in response:
+                        piece = _chunk_text(chunk)
+                        parts.append(piece)
+                        words += len(piece.split())
+                        if words >= GEMINI_WORD_BUDGET:
+                            break
+                finally:
+                    _close_stream(response)
 
-            return "💡 *Analysis generated*"
+            # wait_for cancels read() at the deadline even while it awaits a stalled chunk
+            try:
+                await asyncio.wait_for(read(), timeout=GEMINI_STREAM_TIMEOUT)
+            except asyncio.TimeoutError:
+                return self._gemini_text("".join(parts))
+            return self._gemini_cache_store(key, data_hash, query, prompt, self._gemini_text("".join(parts)))
+        except Exception as e:
+            return self._gemini_error_text(e)
+
+    def _embed_query(self, query: str):
+        """Unit-normalized Gemini embedding of the user's question, or None when unavailable"""
+        if self._gemini_cache is None:
+            return None
+        try:
+            result = _get_genai().embed_content(model=GEMINI_EMBED_MODEL, content=query)
+            vec = np.asarray(result['embedding'], dtype='float32')
+        except Exception as e:
+            print(f"⚠️ Gemini embedding failed, skipping semantic cache: {e}")
+            return None
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else None
 
+    def _cached_enrichment(self, key: str):
+        """Exact-match lookup by enrichment key: in-process first, then SQLite"""
+        text = self._gemini_exact.get(key)
+        if text is not None:
+            self._gemini_exact.move_to_end(key)
+            return text
+        if not self._store:
+            return None
+        try:
+            text = self._store.get_cached_response(key)
         except Exception as e:
-            error_str = str(e).lower()
-            if "rate_limit" in error_str or "resource_exhausted" in error_str:
-                return "⚠️ *API rate limited*"
-            else:
-                return "💡 *Additional insights available*"
-
-    def _format_response_with_gemini(self, enriched_response: dict, gemini_analysis: str) -> str:
-        """Format response combining data analysis and Gemini insights"""
+            print(f"⚠️ Gemini cache lookup failed: {e}")
+            return None
+        if text:
+            self._remember_enrichment(key, text)
+        return text
+
+    def _similar_enrichment(self, query: str, data_hash: str):
+        """Paraphrase fallback: a cached completion for the same rows and a near-identical question.
+        Only embeds the question when such a completion exists, so first-time questions skip the call.
+        """
+        if self._gemini_cache is None or not self._gemini_cache.has_group(data_hash):
+            return None
+        vec = self._embed_query(query)
+        if vec is None:
+            return None
+        return self._gemini_cache.lookup(vec, data_hash)
+
+    def _remember_enrichment(self, key: str, text: str):
+        self._gemini_exact[key] = text
+        self._gemini_exact.move_to_end(key)
+        while len(self._gemini_exact) > SEMANTIC_CACHE_SIZE:
+            self._gemini_exact.popitem(last=False)
+
+    def _index_enrichment(self, query: str, data_hash: str, text: str):
+        """Add a completion to the paraphrase index (runs on the prefetch pool, off the turn)"""
+        vec = self._embed_query(query)
+        if vec is not None:
+            self._gemini_cache.add(vec, text, data_hash)
+
+    def _gemini_cache_store(self, key: str, data_hash: str, query: str, prompt: str, text: str) -> str:
+        # Only real model output is worth reusing, not placeholder/error strings
+        if not text.startswith("🧠"):
+            return text
+        self._remember_enrichment(key, text)
+        if self._gemini_cache is not None:
+            try:
+                self._prefetch_pool.submit(self._index_enrichment, query, data_hash, text)
+            except RuntimeError:
+                pass  # pool already shut down by close()
+        if self._store:
+            try:
+                self._store.put_cached_response(key, prompt, text)
+            except Exception as e:
+                print(f"⚠️ Could not persist Gemini response: {e}")
+        return text
+
+    def _build_turn_prompt(self, query: str, enriched_response: dict) -> str:
+        """Per-turn query, analysis and data rows (the static instructions live in the shared preamble)"""
+        # Build context from enriched response
+        analysis = enriched_response.get('analysis', '')
+        data = enriched_response.get('data', [])[:5]
+        
+        # Format data summary
+        data_summary = "Data rows:\n" + "".join(f"• {row}\n" for row in data)
+
+        return f"""Query: {query}
+
+Current Analysis:
+{analysis[:300]}
+
+{data_summary}"""
+
+    def _build_gemini_contents(self, prompt: str) -> list:
+        """Per-turn prompt, preceded by the shared preamble unless the model already carries it"""
+        if self._preamble_in_model:
+            return [{'role': 'user', 'parts': [prompt]}]
+        return [
+            {'role': 'user', 'parts': [self._system_preamble]},
+            {'role': 'user', 'parts': [prompt]},
+        ]
+
+    @staticmethod
+    def _gemini_text(text: str) -> str:
+        if text:
+            text = text.strip()
+            if len(text) > 20:
+                return f"🧠 **AI Analysis:**\n{text}"
+
+        return "💡 *Analysis generated*"
+
+    @staticmethod
+    def _gemini_error_text(e: Exception) -> str:
+        error_str = str(e).lower()
+        if "rate_limit" in error_str or "resource_exhausted" in error_str:
+            return "⚠️ *API rate limited*"
+        else:
+            return "💡 *Additional insights available*"
+
+    def _format_response_with_gemini(self, enriched_response: dict, gemini_analysis: str,
+                                     data_table: str = None) -> str:
+        """Format response combining data analysis and Gemini insights.
+        data_table may be pre-rendered with _render_data_table() (achat() does this concurrently).
+        """
         
         if enriched_response['status'] == 'error':
             return f"❌ Could not process: {enriched_response.get('error')}"
 
-        response = ""
+        parts = []
 
         # Main analysis
         if 'analysis' in enriched_response:
-            response += enriched_response['analysis']
+            parts.append(enriched_response['analysis'])
 
         # Category insights
         if enriched_response.get('category_insights'):
-            response += "\n\n**📚 Category Context:**\n"
+            parts.append("\n\n**📚 Category Context:**\n")
             for insight in enriched_response['category_insights']:
-                response += f"{insight}\n"
+                parts.append(f"{insight}\n")
 
         # Gemini insights
         if gemini_analysis and "unavailable" not in gemini_analysis.lower():
-            response += f"\n\n{gemini_analysis}"
+            parts.append(f"\n\n{gemini_analysis}")
 
         # Market insight
         if enriched_response.get('market_insight'):
-            response += f"\n\n📊 **Market Context:** {enriched_response['market_insight']}"
+            parts.append(f"\n\n📊 **Market Context:** {enriched_response['market_insight']}")
 
         # Data table
-        if enriched_response.get('data'):
-            response += "\n\n### 📋 Data Details\n"
-            try:
-                df = pd.DataFrame(enriched_response['data'])
-                response += df.to_markdown(index=False)
-            except:
-                pass
-
-        return response
+        if data_table is None:
+            data_table = self._render_data_table(enriched_response)
+        parts.append(data_table)
 
-    def _get_intelligent_follow_ups(self, intent: str, params: dict, enriched_response: dict) -> list:
-        """Generate context-aware and data-informed follow-ups"""
-        
-        follow_ups = []
-
-        if intent == 'top_selling':
-            follow_ups = [
-                "How do these compare month-over-month?",
-                "What's the customer satisfaction for top categories?",
-                "Show geographic distribution of these categories",
-                "What's the price range for each?"
-            ]
-
-        elif intent == 'time_series':
-            follow_ups = [
-                "What's driving the peaks and valleys?",
-                "Any seasonal patterns?",
-                "How does this year compare to last?",
-                "Forecast for next quarter?"
-            ]
-
-        elif intent == 'average_value':
-            follow_ups = [
-                "How does this vary by region?",
-                "Is this trending up or down?",
-                "What's the price distribution?",
-                "Payment method impact?"
-            ]
+        return "".join(parts)
 
-        elif intent == 'delivery_analysis':
-            follow_ups = [
-                "Which regions have fastest delivery?",
-                "Any delivery delays?",
-                "Impact on satisfaction?",
-                "How to improve?"
-            ]
-
-        elif intent == 'geographic':
-            follow_ups = [
-                "Which state spends the most?",
-                "Growth in each region?",
-                "Regional category preferences?",
-                "Delivery performance by region?"
-            ]
-
-        else:
-            follow_ups = [
-                "Want to dig deeper?",
-                "Curious about related metrics?",
-                "Compare across categories?",
-                "Geographic breakdown?"
-            ]
+    @staticmethod
+    def _render_data_table(enriched_response: dict) -> str:
+        """Markdown "Data Details" section for the result rows ('' when there is no data)"""
+        data = enriched_response.get('data')
+        if not data:
+            return ""
+        return "\n\n### 📋 Data Details\n" + _rows_to_markdown(data)
 
-        return follow_ups[:3]  # Return top 3
+    def _get_intelligent_follow_ups(self, intent: str, params: dict, enriched_response: dict) -> tuple:
+        """Generate context-aware and data-informed follow-ups (top 3, shared read-only tuple)"""
+        return _FOLLOW_UPS_BY_INTENT.get(intent, _DEFAULT_FOLLOW_UPS)
 
     def get_conversation_summary(self) -> dict:
         """Get summary of conversation"""
         return {
-            'total_messages': len(self.conversation_history),
-            'user_queries': len([m for m in self.conversation_history if m['role'] == 'user']),
+            'total_messages': self._user_msg_count + self._assistant_msg_count,
+            'user_queries': self._user_msg_count,
             'session_id': self.session_id,
-            'last_query': self.context['questions_asked'][-1] if self.context['questions_asked'] else None,
+            'last_query': self.context['recent_questions'][-1] if self.context['recent_questions'] else None,
             'conversation_turns': self.context['conversation_turns'],
-            'conversation_flow': self.conversation_history[-5:] if len(self.conversation_history) > 0 else []
+            'conversation_flow': list(itertools.islice(reversed(self.conversation_history), 5))[::-1]
         }
 
     def get_full_history(self) -> list:
-        """Get complete conversation history"""
-        return self.conversation_history
+        """Get in-memory conversation history (older messages are in the conversation store)"""
+        return list(self.conversation_history)
 
     def _handle_error(self, error: str, query: str) -> dict:
         """Handle errors with helpful suggestions"""
@@ -1,7 +1,16 @@
+import asyncio
+import hashlib
+import itertools
 import os
+import threading
 import time
 import re
+import sys
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
+from decimal import Decimal
 from typing import Optional, Tuple
 
 import pandas as pd
@@ -15,7 +24,18 @@ except Exception:
     genai = None  # type: ignore
     GEMINI_AVAILABLE = False
 
-from database import get_db
+try:
+    from dotenv import load_dotenv
+except Exception:
+    load_dotenv = None  # type: ignore
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:
+    add_script_run_ctx = get_script_run_ctx = None  # type: ignore
+
+import gemini_client
+from database import DB_LOCK, get_db
 from query_engine import IntelligentQueryEngine
 
 # ============================================================
@@ -34,13 +54,48 @@ st.set_page_config(
 gemini_model = None
 gemini_model_name = None
 gemini_status = "❌ Offline"
+gemini_system_instruction = False
 
 # Preferred model can be overridden via env var GEMINI_MODEL
 PREFERRED_GEMINI = os.getenv("GEMINI_MODEL", "gemini-pro-latest")
 
+# Opt-in: generate insights for the sidebar quick queries in the background at startup
+GEMINI_PRECOMPUTE_QUICK = os.getenv("GEMINI_PRECOMPUTE_QUICK", "0").lower() in ("1", "true", "yes")
+INSIGHT_GENERATION_CONFIG = {"temperature": 0.18, "max_output_tokens": 256}
+INSIGHT_CACHE_SIZE = 128  # per-session model insights kept for repeated queries
+CHAT_HISTORY_MAXLEN = 200
+GEMINI_INSIGHT_TIMEOUT = 15  # seconds to wait for the background insight before falling back
+# insight workers shared by all sessions; each session has at most one insight in flight
+INSIGHT_WORKERS = int(os.getenv("GEMINI_INSIGHT_WORKERS", "8"))
+MIN_ANALYSIS_CHARS = 40  # below this the prompt has too little to ground insights on
+MAX_ANALYSIS_CHARS = 1500  # ~400 input tokens of analysis per insight request
+GEMINI_LOG_MAXLEN = 500
+RESULT_STORE_SIZE = 512  # result row sets kept process-wide, referenced by id from chat_history
+HISTORY_PAGE_SIZE = 10  # previous queries rendered per "Show older" page
+
+# Fixed analyst instructions; sent once as the model's system_instruction so each
+# request only carries the user query and analysis excerpt
+INSIGHT_SYSTEM_INSTRUCTION = """You are an expert e-commerce analyst.
+
+Task:
+- Produce exactly 3 concise, actionable one-line insights or recommendations based only on the data provided.
+- Each insight must be one sentence and begin with a hyphen and a single space ("- ").
+- Use business language and be specific (e.g., "Increase stock for...", "Investigate...", "Promote...").
+- No extra commentary, no numbering, no explanation beyond the 3 lines.
+
+Return exactly 3 lines."""
+
+QUICK_QUERIES = [
+    ("📦 Delivery analysis?", "delivery analysis"),
+    ("🏆 Top selling category?", "top selling category"),
+    ("💳 Payment methods?", "payment methods"),
+    ("🗺️ Geographic distribution?", "geographic distribution"),
+    ("📊 Order status?", "order status"),
+]
+
 # Simple in-session debug storage so the UI can explain why Gemini isn't used
 if "gemini_debug_logs" not in st.session_state:
-    st.session_state["gemini_debug_logs"] = []
+    st.session_state["gemini_debug_logs"] = deque(maxlen=GEMINI_LOG_MAXLEN)
 
 if "gemini_last_response" not in st.session_state:
     st.session_state["gemini_last_response"] = None
@@ -51,6 +106,9 @@ if "gemini_last_extracted" not in st.session_state:
 if "gemini_last_error" not in st.session_state:
     st.session_state["gemini_last_error"] = None
 
+if "insight_cache" not in st.session_state:
+    st.session_state["insight_cache"] = OrderedDict()
+
 
 def _append_gemini_log(msg: str):
     try:
@@ -67,6 +125,24 @@ def _extract_text_from_genai_response(response) -> Optional[str]:
     if response is None:
         return None
 
+    # Fast path for the SDK's GenerateContentResponse: .text, else the first candidate's parts
+    try:
+        text = response.text
+        if text:
+            return str(text)
+    except Exception:
+        pass
+    try:
+        text = "".join(p.text for p in response.candidates[0].content.parts if getattr(p, "text", None))
+        if text:
+            return text
+    except Exception:
+        pass
+    return _extract_text_from_unknown_response(response)
+
+
+def _extract_text_from_unknown_response(response) -> Optional[str]:
+    """Slow path for unexpected response shapes: probe the attributes older SDKs used."""
     try:
         # Newer SDKs often have .text
         if hasattr(response, "text") and getattr(response, "text"):
@@ -130,106 +206,104 @@ def _extract_text_from_genai_response(response) -> Optional[str]:
             return None
 
 
-def _init_gemini():
+@st.cache_resource(show_spinner=False)
+def _init_gemini() -> Tuple[object, Optional[str], str, bool, tuple]:
     """
     Configure google.generativeai and attempt to instantiate a GenerativeModel.
-    By default this does NOT call generate_content() at init to avoid consuming quota.
-    Set GEMINI_SKIP_HEALTHCHECK=0 to re-enable the health-check behavior (not recommended on free tier).
+    Cached with st.cache_resource so it runs once per process, not on every rerun.
+    This never calls generate_content() at init, so no quota is consumed.
+    Set GEMINI_SKIP_HEALTHCHECK=0 to verify model availability with a single list_models() call.
+    Returns (model, model_name, status, has_system_instruction, log_lines).
+    It runs in whichever session got there first, so its log lines are returned rather than written
+    to that session's debug log; every session copies them into its own log (see below).
     """
-    global gemini_model, gemini_model_name, gemini_status
+    init_log = []
 
-    _append_gemini_log("Starting Gemini initialization")
+    def log(msg: str):
+        init_log.append(f"{datetime.utcnow().isoformat()} - {msg}")
+        print("[Gemini-Debug]", msg)
+
+    log("Starting Gemini initialization")
 
     if not GEMINI_AVAILABLE:
-        gemini_status = "⚠️ Gemini SDK not installed"
-        _append_gemini_log("Gemini SDK not installed (google.generativeai import failed).")
-        return None, None, gemini_status
+        log("Gemini SDK not installed (google.generativeai import failed).")
+        return None, None, "⚠️ Gemini SDK not installed", False, tuple(init_log)
 
     # Ensure API key present (try env, then .env)
     api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    if not api_key and load_dotenv is not None:
         try:
-            from dotenv import load_dotenv
             load_dotenv()
             api_key = os.getenv("GOOGLE_API_KEY")
-            _append_gemini_log("Attempted to load .env for GOOGLE_API_KEY.")
+            log("Attempted to load .env for GOOGLE_API_KEY.")
         except Exception as e:
-            _append_gemini_log(f"Could not load .env: {e}")
+            log(f"Could not load .env: {e}")
             api_key = None
 
     if not api_key:
-        gemini_status = "⚠️ No API key (set GOOGLE_API_KEY)"
-        _append_gemini_log("No GOOGLE_API_KEY found in environment.")
-        return None, None, gemini_status
+        log("No GOOGLE_API_KEY found in environment.")
+        return None, None, "⚠️ No API key (set GOOGLE_API_KEY)", False, tuple(init_log)
 
     # Configure SDK
     try:
         genai.configure(api_key=api_key)
-        _append_gemini_log("genai.configure() called successfully.")
+        log("genai.configure() called successfully.")
     except Exception as e:
-        gemini_status = f"❌ genai.configure() failed: {str(e)[:200]}"
-        _append_gemini_log(f"genai.configure() failed: {e}")
-        return None, None, gemini_status
+        log(f"genai.configure() failed: {e}")
+        return None, None, f"❌ genai.configure() failed: {str(e)[:200]}", False, tuple(init_log)
 
     candidate_models = [PREFERRED_GEMINI, "gemini-pro-latest", "gemini-1.5-pro", "gemini-1.5-flash"]
-    # Skip health-check by default to avoid using up quota on init
+    # Skip health-check by default to avoid a network call on init
     skip_health = os.getenv("GEMINI_SKIP_HEALTHCHECK", "1").lower() not in ("0", "false", "no")
 
-    tried = []
-    for m in candidate_models:
-        if not m or (m in tried):
-            continue
+    chosen = PREFERRED_GEMINI or candidate_models[1]
+    verified = False
+    if not skip_health:
+        # One metadata call instead of a generate_content() probe per candidate (no quota used)
         try:
-            # instantiate model object (does not call generate_content)
-            model = genai.GenerativeModel(m)
-            _append_gemini_log(f"Instantiated GenerativeModel for {m}.")
-            if skip_health:
-                # Mark model as configured; do actual generate on-demand and handle errors there.
-                gemini_model = model
-                gemini_model_name = m
-                gemini_status = f"⚠️ Configured ({m}) — health-check skipped"
-                _append_gemini_log(f"Model {m} configured with health-check skipped.")
-                return gemini_model, gemini_model_name, gemini_status
-
-            # If health-check is enabled, perform a lightweight generate here.
-            try:
-                health_resp = model.generate_content(
-                    "Please reply: ok",
-                    generation_config={"temperature": 0.0, "max_output_tokens": 8}
-                )
-                # store raw response string for debugging
-                try:
-                    st.session_state["gemini_last_response"] = str(health_resp)
-                except Exception:
-                    st.session_state["gemini_last_response"] = None
-                text = _extract_text_from_genai_response(health_resp) or ""
-                _append_gemini_log(f"Health-check response for {m}: '{text[:200]}'")
-                if text.strip().lower().startswith("ok") or len(text.strip()) > 0:
-                    gemini_model = model
-                    gemini_model_name = m
-                    gemini_status = f"✅ Online ({m})"
-                    _append_gemini_log(f"Model {m} initialized and passed health-check.")
-                    return gemini_model, gemini_model_name, gemini_status
-                else:
-                    tried.append(m)
-                    _append_gemini_log(f"Model {m} created but health-check returned empty text.")
-            except Exception as gen_exc:
-                tried.append(m)
-                _append_gemini_log(f"Model {m} health-check generate_content() failed: {gen_exc}")
-        except Exception as inst_exc:
-            tried.append(f"{m}: {str(inst_exc)[:200]}")
-            _append_gemini_log(f"Could not instantiate model {m}: {inst_exc}")
-
-    gemini_model = None
-    gemini_model_name = None
-    gemini_status = "⚠️ Model unavailable (see logs)"
-    _append_gemini_log(f"No candidate models available. Tried: {tried}")
-    return None, None, gemini_status
-
-
-# initialize on import
+            available = {
+                m.name.split("/")[-1]
+                for m in genai.list_models()
+                if "generateContent" in getattr(m, "supported_generation_methods", [])
+            }
+            log(f"list_models() returned {len(available)} generateContent models.")
+            match = next((m for m in candidate_models if m and m in available), None)
+            if match is None:
+                log(f"None of {candidate_models} are available for this key.")
+                return None, None, "⚠️ Model unavailable (see logs)", False, tuple(init_log)
+            chosen = match
+            verified = True
+        except Exception as e:
+            # Could not list models; fall back to the preferred model and validate on first request
+            log(f"list_models() failed, using {chosen} unverified: {e}")
+
+    try:
+        # instantiate model object (does not call generate_content)
+        try:
+            model = genai.GenerativeModel(chosen, system_instruction=INSIGHT_SYSTEM_INSTRUCTION)
+            has_system_instruction = True
+        except TypeError:
+            # Older SDKs without system_instruction: the prompt carries the instructions instead
+            model = genai.GenerativeModel(chosen)
+            has_system_instruction = False
+        if verified:
+            status = f"✅ Online ({chosen})"
+        else:
+            status = f"⚠️ Configured ({chosen}) — health-check skipped"
+        log(f"Instantiated GenerativeModel for {chosen} (verified={verified}).")
+        return model, chosen, status, has_system_instruction, tuple(init_log)
+    except Exception as inst_exc:
+        log(f"Could not instantiate model {chosen}: {inst_exc}")
+        return None, None, "⚠️ Model unavailable (see logs)", False, tuple(init_log)
+
+
+# initialize once per process (cached across reruns)
 try:
-    _init_gemini()
+    gemini_model, gemini_model_name, gemini_status, gemini_system_instruction, _gemini_init_log = _init_gemini()
+    # once per session: the cached init ran (and logged) at most once per process
+    if not st.session_state.get("gemini_init_logged"):
+        st.session_state["gemini_debug_logs"].extend(_gemini_init_log)
+        st.session_state["gemini_init_logged"] = True
 except Exception as e:
     gemini_status = f"❌ Error initializing Gemini: {str(e)[:200]}"
     _append_gemini_log(f"Initialization error: {e}")
@@ -238,7 +312,21 @@ except Exception as e:
 # ============================================================
 # HELPERS
 # ============================================================
+# The text helpers below are string work on short inputs (CPython-only by design): Numba
+# would run them in object mode with no speedup, so they stay on compiled re + str methods.
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_LINE_SPLIT = re.compile(r'\r?\n')
+# Error substrings that mark a Gemini failure as transient (worth a retry)
+_TRANSIENT_ERROR_RE = re.compile(
+    "|".join(map(re.escape, ("rate", "timeout", "tempor", "resource_exhausted", "throttl", "connection"))),
+    re.IGNORECASE,
+)
+
+
 def _fmt_currency(v):
+    # DuckDB hands back int/float/Decimal, which format directly; only other types take the try path
+    if isinstance(v, (int, float, Decimal)):
+        return f"R${v:,.2f}"
     try:
         return f"R${float(v):,.2f}"
     except Exception:
@@ -246,12 +334,38 @@ def _fmt_currency(v):
 
 
 def _fmt_int(v):
+    if isinstance(v, int):
+        return f"{v:,}"
     try:
         return f"{int(v):,}"
     except Exception:
         return str(v)
 
 
+_PRIORITIZE_TOP = "Consider prioritizing inventory/marketing for top categories or regions."
+_RECOMMENDATIONS = {
+    "top_selling": _PRIORITIZE_TOP,
+    "time_series": _PRIORITIZE_TOP,
+    "geographic": _PRIORITIZE_TOP,
+    "delivery_analysis": "Investigate carriers/regions with longer delivery times.",
+    "payment_analysis": "Optimize UX for the most-used payment methods.",
+    "top_customers": "Consider loyalty offers for top customers.",
+}
+
+# Display column names per query intent (unknown intents keep DuckDB's positional columns)
+_INTENT_COLUMNS = {
+    "top_selling": ["Category", "Orders", "Revenue (R$)"],
+    "delivery_analysis": ["Metric", "Value"],
+    "time_series": ["Period", "Orders", "Revenue (R$)"],
+    "average_value": ["Category", "Avg Value (R$)", "Orders"],
+    "total_value": ["Metric", "Value"],
+    "payment_analysis": ["Payment Method", "Orders", "Revenue (R$)"],
+    "geographic": ["State", "Orders", "Revenue (R$)"],
+    "order_status": ["Status", "Count", "Percentage"],
+    "top_customers": ["Customer", "Orders", "Lifetime Revenue (R$)", "Repeat Purchase %"],
+}
+
+
 def _fallback_insight_from_data(query_result: dict, user_query: str) -> Tuple[str, str]:
     """
     Deterministic, local fallback insight generator that uses query_result content.
@@ -267,11 +381,7 @@ def _fallback_insight_from_data(query_result: dict, user_query: str) -> Tuple[st
             parts.append(f"{intent.replace('_',' ').title()}.")
 
         # First line of analysis
-        first_line = ""
-        for line in analysis.splitlines():
-            if line.strip():
-                first_line = line.strip()
-                break
+        first_line = next((ln.strip() for ln in analysis.splitlines() if ln.strip()), "")
         if first_line:
             parts.append(first_line if len(first_line) < 300 else first_line[:297] + "...")
 
@@ -291,15 +401,7 @@ def _fallback_insight_from_data(query_result: dict, user_query: str) -> Tuple[st
             else:
                 parts.append(f"Top result: {str(top)[:200]}")
 
-        recommendation = ""
-        if intent in ("top_selling", "time_series", "geographic"):
-            recommendation = "Consider prioritizing inventory/marketing for top categories or regions."
-        elif intent == "delivery_analysis":
-            recommendation = "Investigate carriers/regions with longer delivery times."
-        elif intent == "payment_analysis":
-            recommendation = "Optimize UX for the most-used payment methods."
-        elif intent == "top_customers":
-            recommendation = "Consider loyalty offers for top customers."
+        recommendation = _RECOMMENDATIONS.get(intent, "")
 
         if recommendation:
             parts.append(recommendation)
@@ -308,7 +410,7 @@ def _fallback_insight_from_data(query_result: dict, user_query: str) -> Tuple[st
         if not insight:
             insight = "No actionable insight available from data."
         # Make into up to 3 short bullet lines if possible
-        sentences = re.split(r'(?<=[.!?])\s+', insight)
+        sentences = _SENT_SPLIT.split(insight)
         bullets = sentences[:3]
         bullets = [("- " + b.strip()) for b in bullets if b.strip()]
         if not bullets:
@@ -319,142 +421,390 @@ def _fallback_insight_from_data(query_result: dict, user_query: str) -> Tuple[st
         return ("💡 *Fallback: analysis available (no AI).*", "fallback")
 
 
-def get_gemini_insights(query_result: dict, user_query: str) -> str:
+def _truncate_analysis(analysis: str) -> str:
+    """Cap the analysis at MAX_ANALYSIS_CHARS, cutting after the last complete sentence (end
+    punctuation followed by whitespace) or line; a decimal point like "1.234,56" is never a cut point.
+    """
+    if len(analysis) <= MAX_ANALYSIS_CHARS:
+        return analysis
+    # one extra char so a sentence ending exactly at the limit still shows its trailing whitespace
+    head = analysis[:MAX_ANALYSIS_CHARS + 1]
+    cut = max((m.start() for m in _SENT_SPLIT.finditer(head)), default=-1)
+    cut = max(cut, head.rfind("\n"))
+    if cut <= 0:
+        # no boundary at all: fall back to the last word break
+        cut = head.rfind(" ")
+    return (head[:cut] if cut > 0 else head[:MAX_ANALYSIS_CHARS]).rstrip()
+
+
+def _build_insight_prompt(user_query: str, analysis_excerpt: str) -> str:
+    """Per-query prompt, prefixed with the instructions unless the model already carries them."""
+    tail = f'User asked: "{user_query}"\n\nDatabase analysis (short):\n{analysis_excerpt}'
+    if gemini_system_instruction:
+        return tail
+    return f"{INSIGHT_SYSTEM_INSTRUCTION}\n\n{tail}"
+
+
+def _prompt_key(prompt: str) -> str:
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _quick_insight_key(user_query: str, analysis: str) -> str:
+    """Key of a precomputed quick-query insight; the precompute and the lookup both go through
+    here so they truncate and build the prompt identically."""
+    return _prompt_key(_build_insight_prompt(user_query, _truncate_analysis(analysis)))
+
+
+def _insight_cache_key(user_query: str, analysis_excerpt: str) -> str:
+    raw = user_query.strip().lower() + "\x00" + analysis_excerpt[:2000]
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cache_insight(key: str, insight: str):
+    """Remember a model insight for this session, evicting the least recently used."""
+    cache = st.session_state["insight_cache"]
+    cache[key] = insight
+    cache.move_to_end(key)
+    while len(cache) > INSIGHT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+_BULLET_CHARS = ("-", "•", "*")
+
+
+def _clean_bullet(s: str) -> str:
+    s = " ".join(s.split())
+    if len(s) > 200:
+        s = s[:197].rstrip() + "..."
+    return f"- {s}"
+
+
+def _clean_bullets(text: str, n: int = 3) -> list:
+    """One pass over the lines: keep bullet lines (any of -, •, *), cleaned to one "- " line each, up to n."""
+    out = []
+    for raw in text.splitlines():
+        s = raw.lstrip()
+        if s and s[0] in _BULLET_CHARS:
+            out.append(_clean_bullet(s[1:]))
+            if len(out) >= n:
+                return out
+    if out:
+        return out
+    # No bullet lines: treat each sentence as a bullet
+    for s in _SENT_SPLIT.split(text):
+        s = s.strip()
+        if not s:
+            continue
+        if s[0] in _BULLET_CHARS:
+            s = s[1:]
+        out.append(_clean_bullet(s))
+        if len(out) >= n:
+            break
+    return out
+
+
+def _format_model_insight(text: str, query_result: dict, user_query: str) -> str:
+    """Normalize raw model text into exactly 3 bullet lines (padded from the fallback insight)."""
+    cleaned = _clean_bullets(text)
+    # If not enough, pad with fallback content
+    if len(cleaned) < 3:
+        fallback_text, _ = _fallback_insight_from_data(query_result, user_query)
+        fallback_lines = [ln.strip() for ln in _LINE_SPLIT.split(fallback_text) if ln.strip()]
+        for fl in fallback_lines:
+            if len(cleaned) >= 3:
+                break
+            if fl.startswith("-"):
+                cleaned.append(fl)
+            else:
+                cleaned.append(f"- {fl}")
+    cleaned = cleaned[:3]
+    insight_text = "\n".join(cleaned)
+    return f"🤖 **AI Insight ({gemini_model_name})**:\n{insight_text}\n\n_Source: model_"
+
+
+@st.cache_resource
+def _quick_insight_store() -> dict:
+    """Process-wide store of precomputed quick-query insights, keyed by prompt hash."""
+    return {"insights": {}, "started": False, "lock": threading.Lock()}
+
+
+async def _precompute_quick_insights(engine, model, store: dict):
+    """Run every quick query, then request all their insights at once through gemini_client.
+    Logging uses print(): this daemon thread has no Streamlit session, so the session-state
+    debug log (_append_gemini_log) is not reachable from here.
+    """
+    prompts, keys = [], []
+    for _, qval in QUICK_QUERIES:
+        try:
+            # silent path: the user never asked these, so they stay out of the engine's history
+            result = engine.run_silent(qval)[2]
+        except Exception as e:
+            print("[Gemini-Debug]", f"Quick query {qval!r} failed during precompute: {e}")
+            continue
+        if isinstance(result, dict) and result.get("status") == "success":
+            analysis = _truncate_analysis(result.get("analysis", "") or "")
+            prompts.append(_build_insight_prompt(qval, analysis))
+            keys.append(_quick_insight_key(qval, analysis))
+
+    responses = await asyncio.gather(
+        *(gemini_client.submit(model, p, generation_config=INSIGHT_GENERATION_CONFIG) for p in prompts),
+        return_exceptions=True,
+    )
+    for key, response in zip(keys, responses):
+        if isinstance(response, Exception):
+            print("[Gemini-Debug]", f"Precompute request failed: {response}")
+            continue
+        text = _extract_text_from_genai_response(response)
+        if text and text.strip():
+            store["insights"][key] = text.strip()
+    print("[Gemini-Debug]", f"Precomputed {len(store['insights'])}/{len(QUICK_QUERIES)} quick-query insights.")
+
+
+def _start_quick_insight_precompute(engine, model):
+    """Start the quick-query precompute once per process on a daemon thread."""
+    store = _quick_insight_store()
+    with store["lock"]:
+        if store["started"]:
+            return
+        store["started"] = True
+    threading.Thread(
+        target=lambda: asyncio.run(_precompute_quick_insights(engine, model, store)),
+        name="quick-insights",
+        daemon=True,
+    ).start()
+    _append_gemini_log("Started background precompute of quick-query insights.")
+
+
+@st.cache_resource
+def _insight_executor() -> ThreadPoolExecutor:
+    """Shared pool for insight generation, so it overlaps with rendering the data table.
+    Sized for concurrent sessions (one in-flight insight each, see _submit_insight)."""
+    return ThreadPoolExecutor(max_workers=INSIGHT_WORKERS, thread_name_prefix="insights")
+
+
+def _submit_with_script_ctx(fn, *args, **kwargs):
+    """Submit fn to the insight pool with this script run's context attached, so st.* calls work there."""
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def run():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    return _insight_executor().submit(run)
+
+
+def _submit_insight(*args, **kwargs) -> Tuple[object, threading.Event]:
+    """Start get_gemini_insights for this session, cancelling the session's previous one if still running
+    (a rerun can abandon it mid-wait), so one session never holds more than one pool worker."""
+    previous = st.session_state.get("insight_inflight")
+    if previous is not None:
+        prev_future, prev_cancel = previous
+        if not prev_future.done():
+            prev_cancel.set()
+            prev_future.cancel()
+    cancel = threading.Event()
+    future = _submit_with_script_ctx(get_gemini_insights, *args, cancel=cancel, **kwargs)
+    st.session_state["insight_inflight"] = (future, cancel)
+    return future, cancel
+
+
+def get_gemini_insights(query_result: dict, user_query: str, placeholder=None,
+                        cancel: Optional[threading.Event] = None) -> Optional[str]:
     """
     Ask Gemini for exactly 3 concise, actionable one-line insights.
+    The response is streamed; if `placeholder` (an st.empty()) is given, partial text is shown as it arrives.
     If Gemini is unavailable or the call fails, return deterministic fallback.
     This function logs the raw response and exceptions into session_state for UI troubleshooting.
+    When run in the background, `cancel` is set by the caller once it has stopped waiting (timeout, or a
+    newer query in the same session): from then on nothing is written to the placeholder, the cache,
+    session_state or the debug log, and None is returned.
     """
+    def cancelled() -> bool:
+        return cancel is not None and cancel.is_set()
+
+    # every session-state write (debug log included) goes through these, so a cancelled run stays silent
+    def log(msg: str):
+        if not cancelled():
+            _append_gemini_log(msg)
+
+    def remember(key: str, value):
+        if not cancelled():
+            st.session_state[key] = value
+
     # If model not configured, return fallback
     if not gemini_model:
-        _append_gemini_log("gemini_model is not set; returning fallback insight.")
+        log("gemini_model is not set; returning fallback insight.")
         text, src = _fallback_insight_from_data(query_result, user_query)
         return f"{text}\n\n_Source: {src}_"
 
-    # Build tight prompt: request exactly 3 bullet lines, one sentence each
     analysis_excerpt = query_result.get("analysis", "") or ""
-    prompt = f"""You are an expert e-commerce analyst.
-
-User asked: "{user_query}"
-
-Database analysis (short):
-{analysis_excerpt}
-
-Task:
-- Produce exactly 3 concise, actionable one-line insights or recommendations based only on the data above.
-- Each insight must be one sentence and begin with a hyphen and a single space ("- ").
-- Use business language and be specific (e.g., "Increase stock for...", "Investigate...", "Promote...").
-- No extra commentary, no numbering, no explanation beyond the 3 lines.
-
-Return exactly 3 lines."""
+    if len(analysis_excerpt.strip()) < MIN_ANALYSIS_CHARS or query_result.get("status") != "success":
+        log(
+            f"Skipping Gemini: status={query_result.get('status')!r}, analysis length={len(analysis_excerpt.strip())}."
+        )
+        text, src = _fallback_insight_from_data(query_result, user_query)
+        return f"{text}\n\n_Source: {src}_"
+    if len(analysis_excerpt) > MAX_ANALYSIS_CHARS:
+        # The leading summary is enough for 3 bullets
+        analysis_excerpt = _truncate_analysis(analysis_excerpt)
+        log(f"Analysis excerpt truncated to {len(analysis_excerpt)} chars.")
+
+    cache_key = _insight_cache_key(user_query, analysis_excerpt)
+    cache = st.session_state["insight_cache"]
+    if cache_key in cache:
+        cache.move_to_end(cache_key)
+        log("Insight cache hit; skipping Gemini call.")
+        return cache[cache_key]
+
+    prompt = _build_insight_prompt(user_query, analysis_excerpt)
+    precomputed = _quick_insight_store()["insights"].get(_quick_insight_key(user_query, analysis_excerpt))
+    if precomputed:
+        log("Using precomputed quick-query insight.")
+        insight = _format_model_insight(precomputed, query_result, user_query)
+        if not cancelled():
+            _cache_insight(cache_key, insight)
+        return insight
 
     max_retries = 2
     for attempt in range(max_retries + 1):
+        if cancelled():
+            return None
         try:
-            _append_gemini_log(f"Calling gemini_model.generate_content (attempt {attempt})")
+            log(f"Calling gemini_model.generate_content (attempt {attempt}, streaming)")
             response = gemini_model.generate_content(
                 prompt,
-                generation_config={
-                    "temperature": 0.18,
-                    "max_output_tokens": 256
-                }
+                generation_config=INSIGHT_GENERATION_CONFIG,
+                stream=True,
+                # a stalled stream must not hold a pool worker past the caller's wait
+                request_options={"timeout": GEMINI_INSIGHT_TIMEOUT},
             )
+            buf = []
+            for chunk in response:
+                if cancelled():
+                    # the run already rendered its fallback; stop streaming over it
+                    close = getattr(response, "close", None)
+                    if close is not None:
+                        close()
+                    return None
+                try:
+                    piece = chunk.text
+                except Exception:
+                    piece = ""
+                if piece:
+                    buf.append(piece)
+                    if placeholder is not None:
+                        placeholder.markdown("".join(buf))
+            if cancelled():
+                return None
             # store raw response for debugging
             try:
-                st.session_state["gemini_last_response"] = str(response)
+                remember("gemini_last_response", str(response))
             except Exception:
-                st.session_state["gemini_last_response"] = None
+                remember("gemini_last_response", None)
 
-            extracted = _extract_text_from_genai_response(response)
-            st.session_state["gemini_last_extracted"] = extracted
-            _append_gemini_log(f"Raw extracted text length: {0 if not extracted else len(extracted)}")
+            extracted = "".join(buf) or _extract_text_from_genai_response(response)
+            remember("gemini_last_extracted", extracted)
+            log(f"Raw extracted text length: {0 if not extracted else len(extracted)}")
 
             if not extracted or not extracted.strip():
                 raise RuntimeError("No text in Gemini response")
 
-            text = extracted.strip()
-
-            # Normalize into bullet lines (prefer lines starting with -, •, *; otherwise split to sentences)
-            lines = [ln.strip() for ln in re.split(r"\r?\n", text) if ln.strip()]
-            bullets = [ln for ln in lines if ln.startswith("-") or ln.startswith("•") or ln.startswith("*")]
-            if not bullets:
-                # Sentence-split fallback
-                sents = re.split(r'(?<=[.!?])\s+', text)
-                bullets = []
-                for s in sents:
-                    s = s.strip()
-                    if not s:
-                        continue
-                    bullet = s if s.startswith("-") or s.startswith("•") else f"- {s}"
-                    bullets.append(bullet)
-                    if len(bullets) >= 3:
-                        break
-            # Clean bullets to ensure "- " prefix and one-line
-            cleaned = []
-            for b in bullets:
-                b_clean = re.sub(r'^[-•*]\s*', '', b).strip()
-                b_clean = " ".join(b_clean.split())
-                if len(b_clean) > 200:
-                    b_clean = b_clean[:197].rstrip() + "..."
-                cleaned.append(f"- {b_clean}")
-                if len(cleaned) >= 3:
-                    break
-            # If not enough, pad with fallback content
-            if len(cleaned) < 3:
-                fallback_text, _ = _fallback_insight_from_data(query_result, user_query)
-                fallback_lines = [ln.strip() for ln in re.split(r"\r?\n", fallback_text) if ln.strip()]
-                for fl in fallback_lines:
-                    if len(cleaned) >= 3:
-                        break
-                    if fl.startswith("-"):
-                        cleaned.append(fl)
-                    else:
-                        cleaned.append(f"- {fl}")
-            cleaned = cleaned[:3]
-            insight_text = "\n".join(cleaned)
-            _append_gemini_log("Gemini insights extracted successfully.")
-            st.session_state["gemini_last_error"] = None
-            return f"🤖 **AI Insight ({gemini_model_name})**:\n{insight_text}\n\n_Source: model_"
+            insight = _format_model_insight(extracted.strip(), query_result, user_query)
+            log("Gemini insights extracted successfully.")
+            remember("gemini_last_error", None)
+            if not cancelled():
+                _cache_insight(cache_key, insight)
+            return insight
         except Exception as e:
+            if cancelled():
+                return None
             err = str(e)
-            st.session_state["gemini_last_error"] = err
-            _append_gemini_log(f"[Gemini] attempt {attempt} error: {err}")
-            err_low = err.lower()
-            if attempt < max_retries and any(k in err_low for k in ("rate", "timeout", "tempor", "resource_exhausted", "throttl", "connection")):
+            remember("gemini_last_error", err)
+            log(f"[Gemini] attempt {attempt} error: {err}")
+            if attempt < max_retries and _TRANSIENT_ERROR_RE.search(err):
                 delay = 1.5 ** attempt
-                _append_gemini_log(f"Transient error detected, retrying after {delay:.2f}s")
+                log(f"Transient error detected, retrying after {delay:.2f}s")
                 time.sleep(delay)
                 continue
-            _append_gemini_log("Using deterministic fallback after Gemini error.")
+            log("Using deterministic fallback after Gemini error.")
             text, src = _fallback_insight_from_data(query_result, user_query)
             return f"{text}\n\n_Source: {src}_"
 
 
-def format_data_for_display(data: list, intent: str) -> pd.DataFrame:
+@st.cache_resource
+def _result_rows() -> dict:
+    """Process-wide LRU of result rows by content id; chat_history keeps only the id."""
+    return {"rows": OrderedDict(), "lock": threading.Lock()}
+
+
+def _put_result_rows(result_id: str, rows: tuple):
+    store = _result_rows()
+    with store["lock"]:
+        store["rows"][result_id] = rows
+        store["rows"].move_to_end(result_id)
+        while len(store["rows"]) > RESULT_STORE_SIZE:
+            store["rows"].popitem(last=False)
+
+
+def _store_result_rows(data, intent: str) -> str:
+    """Stash a result's rows (as a tuple of tuples) and return its content id.
+    The session also pins the rows of its latest result, since other sessions' traffic can evict them
+    from the shared LRU while they are still on screen."""
+    rows = tuple(map(tuple, data or ()))
+    result_id = hashlib.blake2b(repr((intent, rows)).encode("utf-8"), digest_size=16).hexdigest()
+    _put_result_rows(result_id, rows)
+    st.session_state["pinned_result"] = (result_id, rows)
+    return result_id
+
+
+def _lookup_result_rows(result_id) -> tuple:
+    """Rows for a result id; the session's pinned latest result is put back into the shared store
+    if it was evicted, so _result_frame/_csv_bytes (keyed on the id) can find it too."""
+    pinned = st.session_state.get("pinned_result")
+    if pinned is not None and pinned[0] == result_id:
+        if result_id not in _result_rows()["rows"]:
+            _put_result_rows(result_id, pinned[1])
+        return pinned[1]
+    return _result_rows()["rows"].get(result_id, ())
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _result_frame(result_id: str, intent: str) -> pd.DataFrame:
+    """Display DataFrame for a stored result, built once per result id (hashing the id, not the rows)."""
+    return format_data_for_display(_lookup_result_rows(result_id), intent)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _csv_bytes(result_id: str, intent: str) -> bytes:
+    """CSV download payload, encoded once per unique result."""
+    return _result_frame(result_id, intent).to_csv(index=False).encode("utf-8")
+
+
+def _currency_column_config(df: pd.DataFrame) -> dict:
+    """Let the Streamlit grid format R$ columns client-side instead of stringifying them in Python."""
+    return {
+        col: st.column_config.NumberColumn(format="R$ %.2f")
+        for col in df.columns
+        if str(col).endswith("(R$)") and pd.api.types.is_numeric_dtype(df[col])
+    }
+
+
+def format_data_for_display(data, intent: str) -> pd.DataFrame:
     """Format query results as DataFrame for display in Streamlit."""
     if not data or len(data) == 0:
         return pd.DataFrame()
     try:
-        if intent == "top_selling":
-            df = pd.DataFrame(data, columns=["Category", "Orders", "Revenue (R$)"])
-        elif intent == "delivery_analysis":
-            df = pd.DataFrame(data, columns=["Metric", "Value"])
-        elif intent == "time_series":
-            df = pd.DataFrame(data, columns=["Period", "Orders", "Revenue (R$)"])
-        elif intent == "average_value":
-            df = pd.DataFrame(data, columns=["Category", "Avg Value (R$)", "Orders"])
-        elif intent == "total_value":
-            df = pd.DataFrame(data, columns=["Metric", "Value"])
-        elif intent == "payment_analysis":
-            df = pd.DataFrame(data, columns=["Payment Method", "Orders", "Revenue (R$)"])
-        elif intent == "geographic":
-            df = pd.DataFrame(data, columns=["State", "Orders", "Revenue (R$)"])
-        elif intent == "order_status":
-            df = pd.DataFrame(data, columns=["Status", "Count", "Percentage"])
-        elif intent == "top_customers":
-            df = pd.DataFrame(data, columns=["Customer", "Orders", "Lifetime Revenue (R$)", "Repeat Purchase %"])
-        else:
-            df = pd.DataFrame(data)
+        columns = _INTENT_COLUMNS.get(intent)
+        df = pd.DataFrame(data, columns=columns) if columns else pd.DataFrame(data)
+        # DuckDB returns DECIMAL as Python Decimal objects; cast whole columns once so
+        # display formatting and CSV export run on float64 instead of per-value objects
+        for col in df.columns:
+            if str(col).endswith("(R$)"):
+                try:
+                    df[col] = df[col].astype(float)
+                except (TypeError, ValueError):
+                    pass
         return df
     except Exception:
         try:
@@ -463,14 +813,24 @@ def format_data_for_display(data: list, intent: str) -> pd.DataFrame:
             return pd.DataFrame()
 
 
+@st.cache_resource(show_spinner=False)
+def init_engine() -> IntelligentQueryEngine:
+    """One query engine per process, shared by every session (its DB access is serialized by a lock)."""
+    return IntelligentQueryEngine()
+
+
+def _show_older_queries():
+    st.session_state.history_page += 1
+
+
 # ============================================================
 # SESSION STATE - initialize
 # ============================================================
 if "query_engine" not in st.session_state:
-    st.session_state.query_engine = IntelligentQueryEngine()
+    st.session_state.query_engine = init_engine()
 
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_MAXLEN)
 
 if "query_input" not in st.session_state:
     st.session_state.query_input = ""
@@ -478,6 +838,15 @@ if "query_input" not in st.session_state:
 if "run_query" not in st.session_state:
     st.session_state.run_query = False
 
+if "history_seq" not in st.session_state:
+    st.session_state.history_seq = 0
+
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 1
+
+if GEMINI_PRECOMPUTE_QUICK and gemini_model:
+    _start_quick_insight_precompute(st.session_state.query_engine, gemini_model)
+
 # ============================================================
 # MAIN UI
 # ============================================================
@@ -492,7 +861,8 @@ with col1:
 with col2:
     try:
         db = get_db()
-        order_count = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        with DB_LOCK:
+            order_count = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
         st.markdown(f"**Database**: ✅ {order_count:,} orders")
     except Exception:
         st.markdown("**Database**: ⚠️ Issue")
@@ -502,15 +872,7 @@ st.divider()
 with st.sidebar:
     st.header("🚀 Quick Analytics")
     st.subheader("📊 Popular Questions")
-    quick_queries = [
-        ("📦 Delivery analysis?", "delivery analysis"),
-        ("🏆 Top selling category?", "top selling category"),
-        ("💳 Payment methods?", "payment methods"),
-        ("🗺️ Geographic distribution?", "geographic distribution"),
-        ("📊 Order status?", "order status"),
-        
-    ]
-    for qtext, qval in quick_queries:
+    for qtext, qval in QUICK_QUERIES:
         if st.button(qtext, key=f"quick_{qval}", use_container_width=True):
             st.session_state.query_input = qval
             st.session_state.run_query = True
@@ -542,10 +904,20 @@ if st.session_state.get("run_query", False):
                     "data": []
                 }
 
+            # Keep the (possibly large) rows out of session_state; the history item holds their id
+            result_id = None
+            if isinstance(result, dict):
+                result_id = _store_result_rows(result.get("data"), result.get("intent", ""))
+                result = {k: v for k, v in result.items() if k != "data"}
+            st.session_state.history_seq += 1
+            now = datetime.utcnow()
             st.session_state.chat_history.append({
+                "id": st.session_state.history_seq,
                 "query": effective_query,
                 "result": result,
-                "timestamp": datetime.utcnow()
+                "result_id": result_id,
+                "timestamp": now,
+                "timestamp_str": now.strftime("%Y-%m-%d %H:%M:%S")
             })
 
         # reset input and flag
@@ -558,6 +930,8 @@ if st.session_state.chat_history:
     st.markdown("---")
     st.markdown(f"### 💬 {latest['query']}")
     result = latest["result"]
+    if isinstance(result, dict):
+        result = dict(result, data=_lookup_result_rows(latest.get("result_id")))
 
     if not isinstance(result, dict):
         st.error("Unexpected result format (not a dict).")
@@ -568,15 +942,52 @@ if st.session_state.chat_history:
             st.markdown(result.get("analysis", "No analysis available"))
 
 
-            # AI insights (Gemini or fallback)
-            with st.expander("🤖 AI-Enhanced Insights", expanded=True):
-                ai_insight = get_gemini_insights(result, latest["query"])
+            # AI insights (Gemini or fallback): start generating now, render the data table meanwhile
+            insights_box = st.expander("🤖 AI-Enhanced Insights", expanded=True)
+            with insights_box:
+                source_slot = st.empty()
+                insight_slot = st.empty()
+            insight_future, insight_cancel = _submit_insight(result, latest["query"], placeholder=insight_slot)
+
+            # Data table + download
+            if result.get("data"):
+                with st.expander("📊 View Data Table", expanded=False):
+                    intent = result.get("intent", "")
+                    df = _result_frame(latest["result_id"], intent)
+                    if not df.empty:
+                        st.dataframe(df, use_container_width=True, column_config=_currency_column_config(df))
+                        try:
+                            csv = _csv_bytes(latest["result_id"], intent)
+                            st.download_button("⬇️ Download CSV", csv, file_name="query_result.csv", mime="text/csv")
+                        except Exception:
+                            st.info("Download not available for this result.")
+
+            with insights_box:
+                try:
+                    ai_insight = insight_future.result(timeout=GEMINI_INSIGHT_TIMEOUT)
+                except FutureTimeoutError:
+                    # the worker stops writing to insight_slot and the caches once it sees this
+                    insight_cancel.set()
+                    _append_gemini_log(f"Gemini insight timed out after {GEMINI_INSIGHT_TIMEOUT}s; using fallback.")
+                    ai_insight = None
+                except Exception as e:
+                    # get_gemini_insights handles Gemini/API errors itself, so anything raised here is
+                    # a bug: keep the page usable but put the full traceback in the server log and debug panel
+                    insight_cancel.set()
+                    tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                    print(tb, file=sys.stderr)
+                    _append_gemini_log(f"Background insight raised unexpectedly:\n{tb}")
+                    ai_insight = None
+                if ai_insight is None:
+                    text, src = _fallback_insight_from_data(result, latest["query"])
+                    ai_insight = f"{text}\n\n_Source: {src}_"
                 # show source badge
                 if "AI Insight" in ai_insight and gemini_model_name:
-                    st.markdown(f"**Source:** {gemini_model_name}\n\n")
+                    source_slot.markdown(f"**Source:** {gemini_model_name}\n\n")
                 elif "Fallback Insight" in ai_insight or ai_insight.endswith("_fallback_"):
-                    st.markdown("**Source:** fallback\n\n")
-                st.markdown(ai_insight)
+                    source_slot.markdown("**Source:** fallback\n\n")
+                # replaces the partial streamed text with the normalized bullets
+                insight_slot.markdown(ai_insight)
 
                 # Gemini debug sub-expander (helps diagnose why model branch wasn't used)
                 with st.expander("🛠 Gemini Debug (for troubleshooting)", expanded=False):
@@ -598,20 +1009,9 @@ if st.session_state.chat_history:
                     except Exception:
                         st.text("No error recorded")
                     st.write("Recent Gemini logs (most recent last):")
-                    for line in (st.session_state.get("gemini_debug_logs") or [])[-50:]:
+                    logs = st.session_state.get("gemini_debug_logs") or ()
+                    for line in itertools.islice(logs, max(0, len(logs) - 50), None):
                         st.text(line)
-
-            # Data table + download
-            if result.get("data"):
-                with st.expander("📊 View Data Table", expanded=False):
-                    df = format_data_for_display(result["data"], result.get("intent", ""))
-                    if not df.empty:
-                        st.dataframe(df, use_container_width=True)
-                        try:
-                            csv = df.to_csv(index=False).encode("utf-8")
-                            st.download_button("⬇️ Download CSV", csv, file_name="query_result.csv", mime="text/csv")
-                        except Exception:
-                            st.info("Download not available for this result.")
         elif status == "error":
             st.error(f"❌ {result.get('error', 'An error occurred')}")
             if result.get("suggestion"):
@@ -626,7 +1026,8 @@ if st.session_state.chat_history:
 # Previous queries panel (clickable restore/run)
 if len(st.session_state.chat_history) > 1:
     with st.expander("📜 Previous Queries", expanded=False):
-        for idx, item in enumerate(reversed(st.session_state.chat_history[:-1]), 1):
+        shown = st.session_state.history_page * HISTORY_PAGE_SIZE
+        for idx, item in enumerate(itertools.islice(reversed(st.session_state.chat_history), 1, shown + 1), 1):
             col1, col2, col3, col4 = st.columns([6, 2, 1, 1])
             with col1:
                 st.markdown(f"**{idx}. {item['query']}**")
@@ -636,25 +1037,24 @@ if len(st.session_state.chat_history) > 1:
                     preview = analysis_text[:180] + ("..." if len(analysis_text) > 180 else "")
                     st.caption(preview)
             with col2:
-                ts = item.get("timestamp")
-                try:
-                    st.caption(ts.strftime("%Y-%m-%d %H:%M:%S"))
-                except Exception:
-                    st.caption(str(ts))
+                # formatted once at append time, so reruns don't strftime every row
+                st.caption(item.get("timestamp_str") or str(item.get("timestamp")))
             with col3:
                 if item["result"] and isinstance(item["result"], dict) and item["result"].get("status") == "success":
                     st.success("Found")
                 else:
                     st.warning("No data / Error")
             with col4:
-                restore_key = f"restore_{idx}_{hash(item['query'])}"
-                run_key = f"run_{idx}_{hash(item['query'])}"
+                restore_key = f"restore_{item.get('id', idx)}"
+                run_key = f"run_{item.get('id', idx)}"
                 if st.button("🔁 Restore", key=restore_key):
                     st.session_state.query_input = item["query"]
                 if st.button("▶️ Run", key=run_key):
                     st.session_state.query_input = item["query"]
                     st.session_state.run_query = True
             st.divider()
+        if len(st.session_state.chat_history) - 1 > shown:
+            st.button("⬇️ Show older", key="history_more", on_click=_show_older_queries)
 
 # Footer
 st.markdown("---")
@@ -1,50 +1,276 @@
 # database.py 
 import duckdb
 import pandas as pd
+import json
 import os
-import glob
-from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
+# Keep a Zstd Parquet copy of each CSV next to it and query that (set DB_PARQUET_CACHE=0 to disable)
+PARQUET_CACHE = os.environ.get('DB_PARQUET_CACHE', '1').lower() not in ('0', 'false', 'no')
+
+# Parquet copies written sorted on a column, in small row groups, so range filters on it skip
+# whole row groups via their min/max statistics (e.g. the engine's purchase-date cutoffs)
+PARQUET_SORT_KEYS = {'orders': 'order_purchase_timestamp'}
+SORTED_ROW_GROUP_SIZE = 16384
+
+# Per-table load lines (row counts, column preview); off by default, set DB_VERBOSE=1
+VERBOSE = os.environ.get('DB_VERBOSE', '0') == '1'
+
+# Max CSV files ingested concurrently
+LOAD_WORKERS = 8
+
+# Per-file pandas dtypes remembered for the pandas fallback reader
+SCHEMA_CACHE_NAME = '.schema_cache.json'
+_schema_lock = threading.Lock()
+
 _db_instance = None
+# Guards the one shared connection returned by get_db(): every engine, chatbot, tool and the
+# app's status line execute statements on it (re-entrant so callers can nest helpers)
+DB_LOCK = threading.RLock()
+
+# Exact row count per table, recorded by load_data() while ingesting
+_ROW_COUNTS = {}
 
 def get_db():
     """Get or create database instance"""
     global _db_instance
     if _db_instance is None:
-        _db_instance = load_data()
+        with DB_LOCK:
+            if _db_instance is None:
+                _db_instance = load_data()
     return _db_instance
 
+def _sql_literal(value):
+    """Quote a string as a SQL literal (for file paths in DuckDB table functions)"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _csv_source(filepath):
+    """read_csv_auto() call for one CSV file"""
+    return f"read_csv_auto({_sql_literal(filepath)}, header=true, sample_size=-1, ignore_errors=true)"
+
+def _parquet_cache(conn, csv_path, sort_key=None):
+    """
+    Transcode csv_path to a sibling .parquet (Zstd) if it is missing or older than the CSV,
+    ordered by sort_key when given (and the CSV has that column).
+    Returns the Parquet path, or None if it can't be written (e.g. read-only data folder).
+    """
+    pq_path = os.path.splitext(csv_path)[0] + '.parquet'
+    try:
+        if not os.path.exists(pq_path) or os.path.getmtime(csv_path) > os.path.getmtime(pq_path):
+            # Write to a temp file first so an interrupted COPY never looks like a fresh cache
+            tmp_path = pq_path + '.tmp'
+            copy_sql = (
+                f"COPY (SELECT * FROM {_csv_source(csv_path)}) TO {_sql_literal(tmp_path)} "
+                f"(FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            if sort_key:
+                try:
+                    conn.execute(
+                        f"COPY (SELECT * FROM {_csv_source(csv_path)} ORDER BY {sort_key}) TO {_sql_literal(tmp_path)} "
+                        f"(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {SORTED_ROW_GROUP_SIZE})"
+                    )
+                except duckdb.BinderException:
+                    # no such column in this CSV: write it unsorted
+                    conn.execute(copy_sql)
+            else:
+                conn.execute(copy_sql)
+            os.replace(tmp_path, pq_path)
+        return pq_path
+    except (OSError, duckdb.Error) as e:
+        print(f"⚠️  {os.path.basename(csv_path):30s} | Parquet cache unavailable ({str(e)[:40]}), reading CSV")
+        return None
+
+def _table_name_for(filename):
+    """Create table name from filename (remove .csv and convert to lowercase)"""
+    table_name = os.path.splitext(filename)[0].replace('-', '_').lower()
+    
+    # Handle special cases
+    if 'order_items' in table_name:
+        table_name = 'order_items'
+    elif 'orders' in table_name and 'items' not in table_name:
+        table_name = 'orders'
+    elif 'customer' in table_name:
+        table_name = 'customers'
+    elif 'review' in table_name:
+        table_name = 'reviews'
+    elif 'seller' in table_name:
+        table_name = 'sellers'
+    elif 'product' in table_name and 'category' not in table_name:
+        table_name = 'products'
+    elif 'category' in table_name:
+        table_name = 'category_names'
+    elif 'payment' in table_name:
+        table_name = 'payments'
+    elif 'geo' in table_name:
+        table_name = 'geolocation'
+    return table_name
+
+def _connect(data_dir):
+    """
+    Open the persistent DuckDB file (DUCKDB_PATH, default data/cache.duckdb).
+    Returns (conn, mtime of the DB file before this load, or None for a new/in-memory DB).
+    Falls back to an in-memory DB if the file is locked by another process.
+    """
+    db_path = os.environ.get('DUCKDB_PATH', os.path.join(data_dir, 'cache.duckdb'))
+    db_mtime = os.path.getmtime(db_path) if db_path != ':memory:' and os.path.exists(db_path) else None
+    try:
+        return duckdb.connect(db_path), db_mtime
+    except duckdb.Error as e:
+        print(f"⚠️  Could not open {db_path} ({str(e)[:60]}), using in-memory database")
+        return duckdb.connect(':memory:'), None
+
+def _existing_relations(conn):
+    """{name: view SQL, or None for a base table} for relations already in the DB file"""
+    existing = {
+        row[0]: None
+        for row in conn.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE database_name = current_database()"
+        ).fetchall()
+    }
+    existing.update(conn.execute(
+        "SELECT view_name, sql FROM duckdb_views() WHERE NOT internal AND database_name = current_database()"
+    ).fetchall())
+    return existing
+
+def _is_fresh(filepath, table_name, existing, db_mtime):
+    """
+    True when table_name can be reused from the DB file as is: the CSV is older than the DB, and
+    for a Parquet-backed view, the view still points at this CSV's .parquet sibling (the checkout
+    may have moved) and that file still exists and is at least as new as the CSV.
+    """
+    if table_name not in existing or db_mtime is None:
+        return False
+    csv_mtime = os.path.getmtime(filepath)
+    if csv_mtime >= db_mtime:
+        return False
+    view_sql = existing[table_name]
+    if view_sql is None:
+        return True
+    pq_path = os.path.splitext(filepath)[0] + '.parquet'
+    return (
+        PARQUET_CACHE
+        and pq_path in view_sql
+        and os.path.exists(pq_path)
+        and os.path.getmtime(pq_path) >= csv_mtime
+    )
+
+def _load_file(conn, filepath, existing=None, db_mtime=None):
+    """
+    Load one CSV into its table on a dedicated cursor (safe to run from a worker thread).
+    Skips ingestion when the table in the DB file is still valid for this CSV (see _is_fresh()).
+    Returns (table_name, row_count, column preview); the preview is only built when VERBOSE.
+    """
+    filename = os.path.basename(filepath)
+    table_name = _table_name_for(filename)
+    cur = conn.cursor()
+    try:
+        if not _is_fresh(filepath, table_name, existing or {}, db_mtime):
+            _ingest_file(cur, filepath, table_name)
+        
+        row_count = cur.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        cols = ''
+        if VERBOSE:
+            col_info = cur.execute(f"PRAGMA table_info({table_name})").fetchall()
+            cols = ', '.join([f"{col[1]}({str(col[2])[:3].lower()})" for col in col_info[:3]])
+        return table_name, row_count, cols
+    finally:
+        cur.close()
+
+def _read_csv_pandas(filepath):
+    """
+    pandas fallback reader. Reuses the dtypes inferred on the previous load of this file
+    (data/.schema_cache.json) so pandas skips object-dtype inference over every column.
+    """
+    cache_path = os.path.join(os.path.dirname(filepath), SCHEMA_CACHE_NAME)
+    filename = os.path.basename(filepath)
+    with _schema_lock:
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                schemas = json.load(f)
+        except (OSError, ValueError):
+            schemas = {}
+    
+    dtypes = schemas.get(filename)
+    df = None
+    if dtypes:
+        try:
+            df = pd.read_csv(filepath, on_bad_lines='skip', engine='c', low_memory=False,
+                             dtype=dtypes, usecols=list(dtypes))
+        except (ValueError, TypeError, KeyError):
+            df = None  # schema drifted (new columns, NaNs in an int column, ...): infer again
+    if df is None:
+        df = pd.read_csv(filepath, on_bad_lines='skip', engine='c', low_memory=False)
+        with _schema_lock:
+            try:
+                with open(cache_path, encoding='utf-8') as f:
+                    schemas = json.load(f)
+            except (OSError, ValueError):
+                schemas = {}
+            schemas[filename] = {col: str(dtype) for col, dtype in df.dtypes.items()}
+            try:
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(schemas, f)
+            except OSError:
+                pass
+    return df
+
+def _ingest_file(cur, filepath, table_name):
+    """(Re)create table_name from filepath, as a Parquet-backed view or a table"""
+    filename = os.path.basename(filepath)
+    # A persisted DB may hold the other kind of relation under this name (e.g. cache toggled)
+    kind = cur.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = ?", [table_name]
+    ).fetchone()
+    if kind:
+        cur.execute(f"DROP {'VIEW' if kind[0] == 'VIEW' else 'TABLE'} IF EXISTS {table_name}")
+    
+    # Serve from the Parquet copy when available, so warm starts skip CSV parsing entirely
+    pq_path = _parquet_cache(cur, filepath, PARQUET_SORT_KEYS.get(table_name)) if PARQUET_CACHE else None
+    if pq_path:
+        cur.execute(f"CREATE VIEW {table_name} AS SELECT * FROM read_parquet({_sql_literal(pq_path)})")
+        return
+    
+    # Load with DuckDB's native CSV reader (no pandas DataFrame kept on the Python heap)
+    try:
+        cur.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {_csv_source(filepath)}")
+    except duckdb.Error as parse_error:
+        # Fall back to pandas for files DuckDB's sniffer can't handle. Registered views are
+        # local to this cursor, so copy the frame into a real table the main connection sees
+        print(f"⚠️  {filename:30s} | DuckDB reader failed ({str(parse_error)[:40]}), using pandas")
+        df = _read_csv_pandas(filepath)
+        cur.register('_csv_fallback', df)
+        cur.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM _csv_fallback")
+        cur.unregister('_csv_fallback')
+
 def load_data():
     """
     Auto-loads ALL CSV files from the 'data/' folder into DuckDB
     Handles any CSV structure automatically
     """
     try:
-        conn = duckdb.connect(':memory:')
-        
         # Get data directory
-        current_dir = Path(__file__).parent
-        data_dir = current_dir / 'data'
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
         
         # If data folder doesn't exist in same directory, try common locations
-        if not data_dir.exists():
-            alternative_paths = [
-                Path('data'),
-                Path('./data'),
-                Path('../data'),
-                Path(os.path.expanduser('~/data')),
-            ]
-            for alt_path in alternative_paths:
-                if alt_path.exists():
+        if not os.path.isdir(data_dir):
+            for alt_path in ('data', './data', '../data', os.path.expanduser('~/data')):
+                if os.path.isdir(alt_path):
                     data_dir = alt_path
                     break
         
-        if not data_dir.exists():
+        if not os.path.isdir(data_dir):
             raise FileNotFoundError(f"❌ Data folder not found. Looked in: {data_dir}")
+        # Absolute, so views persisted in the DB file still resolve from another working directory
+        data_dir = os.path.abspath(data_dir)
+        
+        conn, db_mtime = _connect(data_dir)
+        existing = _existing_relations(conn)
         
-        # Find all CSV files
-        csv_files = glob.glob(str(data_dir / '*.csv'))
+        # Find all CSV files (one directory read, no glob/Path objects)
+        with os.scandir(data_dir) as entries:
+            csv_files = [e.path for e in entries if e.is_file() and e.name.lower().endswith('.csv')]
         
         if not csv_files:
             raise FileNotFoundError(f"❌ No CSV files found in {data_dir}")
@@ -52,48 +278,25 @@ def load_data():
         print(f"📂 Loading from: {data_dir}")
         print(f"🔍 Found {len(csv_files)} CSV files\n")
         
-        # Load each CSV file
+        # Load the CSV files concurrently; DuckDB releases the GIL while it reads and parses
         loaded_tables = {}
-        for filepath in sorted(csv_files):
-            filename = os.path.basename(filepath)
-            
-            try:
-                # Read CSV
-                df = pd.read_csv(filepath, on_bad_lines='skip')
-                
-                # Create table name from filename (remove .csv and convert to lowercase)
-                table_name = os.path.splitext(filename)[0].replace('-', '_').lower()
-                
-                # Handle special cases
-                if 'order_items' in table_name:
-                    table_name = 'order_items'
-                elif 'orders' in table_name and 'items' not in table_name:
-                    table_name = 'orders'
-                elif 'customer' in table_name:
-                    table_name = 'customers'
-                elif 'review' in table_name:
-                    table_name = 'reviews'
-                elif 'seller' in table_name:
-                    table_name = 'sellers'
-                elif 'product' in table_name and 'category' not in table_name:
-                    table_name = 'products'
-                elif 'category' in table_name:
-                    table_name = 'category_names'
-                elif 'payment' in table_name:
-                    table_name = 'payments'
-                elif 'geo' in table_name:
-                    table_name = 'geolocation'
-                
-                # Register with DuckDB
-                conn.register(table_name, df)
-                loaded_tables[table_name] = len(df)
-                
-                # Pretty print
-                cols = ', '.join([f"{col}({df[col].dtype.name[:3]})" for col in df.columns[:3]])
-                print(f"✅ {table_name:30s} | {len(df):8,d} rows | Cols: {cols}...")
-                
-            except Exception as e:
-                print(f"⚠️  {filename:30s} | Error: {str(e)[:50]}")
+        with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(csv_files))) as pool:
+            futures = {pool.submit(_load_file, conn, filepath, existing, db_mtime): filepath for filepath in sorted(csv_files)}
+            for future in as_completed(futures):
+                filename = os.path.basename(futures[future])
+                try:
+                    table_name, row_count, cols = future.result()
+                    loaded_tables[table_name] = row_count
+                    
+                    # Pretty print
+                    if VERBOSE:
+                        print(f"✅ {table_name:30s} | {row_count:8,d} rows | Cols: {cols}...")
+                    
+                except Exception as e:
+                    print(f"⚠️  {filename:30s} | Error: {str(e)[:50]}")
+        
+        _ROW_COUNTS.clear()
+        _ROW_COUNTS.update(loaded_tables)
         
         print(f"\n✅ Database loaded successfully!")
         print(f"📊 Total tables: {len(loaded_tables)}\n")
@@ -113,26 +316,30 @@ def test_connection():
         
         conn = load_data()
         
-        # Get all tables
-        tables = conn.execute(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema='memory' ORDER BY table_name"
-        ).fetchall()
+        # Column lists for every table in one grouped catalog query
+        meta = conn.execute("""
+            SELECT table_name, list(column_name ORDER BY ordinal_position) AS cols
+            FROM information_schema.columns
+            WHERE table_catalog = current_database() AND table_schema = current_schema()
+            GROUP BY table_name
+            ORDER BY table_name
+        """).fetchall()
+        
+        # Row counts recorded at load time; one UNION ALL query for any table not loaded from a CSV
+        row_counts = dict(_ROW_COUNTS)
+        missing = [table_name for table_name, _ in meta if table_name not in row_counts]
+        if missing:
+            count_sql = " UNION ALL ".join(
+                f"SELECT {_sql_literal(table_name)}, COUNT(*) FROM {table_name}" for table_name in missing
+            )
+            row_counts.update(conn.execute(count_sql).fetchall())
         
         print("\n📋 AVAILABLE TABLES:")
         print("-" * 80)
         
-        for table in tables:
-            table_name = table[0]
-            
-            # Get row count
-            row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-            
-            # Get columns
-            cols_result = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
-            col_names = [col[1] for col in cols_result]
-            
+        for table_name, col_names in meta:
             print(f"\n📦 {table_name.upper()}")
-            print(f"   Rows: {row_count:,}")
+            print(f"   Rows: {row_counts.get(table_name, 0):,}")
             print(f"   Columns ({len(col_names)}): {', '.join(col_names[:5])}", end="")
             if len(col_names) > 5:
                 print(f" + {len(col_names) - 5} more", end="")
@@ -154,11 +361,12 @@ def get_table_info(table_name):
     try:
         conn = get_db()
         
-        # Get schema
-        schema = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
-        
-        # Get sample data
-        sample = conn.execute(f"SELECT * FROM {table_name} LIMIT 5").fetchall()
+        with DB_LOCK:
+            # Get schema
+            schema = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+            
+            # Get sample data
+            sample = conn.execute(f"SELECT * FROM {table_name} LIMIT 5").fetchall()
         
         return {
             'schema': schema,
@@ -171,27 +379,25 @@ def execute_query(query_str):
     """Execute raw query (for debugging)"""
     try:
         conn = get_db()
-        result = conn.execute(query_str).fetchall()
+        with DB_LOCK:
+            result = conn.execute(query_str).fetchall()
         return result
     except Exception as e:
         return {'error': str(e)}
 
 def get_stats():
-    """Get database statistics"""
+    """Get database statistics (row count per table)"""
     try:
         conn = get_db()
+        if _ROW_COUNTS:
+            return dict(_ROW_COUNTS)
         
-        stats = {}
-        tables = conn.execute(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema='memory'"
-        ).fetchall()
-        
-        for table in tables:
-            table_name = table[0]
-            count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-            stats[table_name] = count
-        
-        return stats
+        # Nothing recorded at load time: use the catalog's row estimate instead of scanning every table
+        with DB_LOCK:
+            return dict(conn.execute(
+                "SELECT table_name, estimated_size FROM duckdb_tables() "
+                "WHERE database_name = current_database() AND schema_name = current_schema()"
+            ).fetchall())
     except Exception as e:
         return {'error': str(e)}
 
@@ -0,0 +1,63 @@
+# gemini_client.py - Rate-limited concurrent Gemini calls for async callers
+#
+# Async callers (EnhancedConversationalChatbot.achat, eval/replay scripts running
+# asyncio.gather over many turns) go through submit() so that at most
+# GEMINI_MAX_CONCURRENT requests are in flight and no more than GEMINI_RPM start per minute.
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "8"))
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_RPM", "60"))
+
+
+class _TokenBucket:
+    """Allow at most `rate` acquisitions per `period` seconds (shared across event loops)"""
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.rate = max(1, rate)
+        self.period = period
+        self._tokens = float(self.rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_take(self) -> float:
+        """Take a token if available; otherwise return seconds to wait for the next one"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) * self.period / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._try_take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_limiter = _TokenBucket(REQUESTS_PER_MINUTE)
+# asyncio.Semaphore is bound to the loop it is used on, so keep one per running loop
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT)
+    return sem
+
+
+async def submit(model, contents, **kwargs):
+    """Await model.generate_content_async(contents, **kwargs) under the concurrency and rate limits"""
+    async with _semaphore():
+        await _limiter.acquire()
+        return await model.generate_content_async(contents, **kwargs)
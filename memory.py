@@ -1,33 +1,97 @@
 # memory.py - Persistent conversational memory using SQLite + optional Sentence-Transformers embeddings
 # Place this file in your project root. Requires: pip install sentence-transformers (optional)
 
+import atexit
+import importlib.util
 import os
 import sqlite3
 import json
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional
 
 try:
     import numpy as np
-    from sentence_transformers import SentenceTransformer
-    HAS_EMBED = True
+    # sentence_transformers (and torch) are only imported when a MemoryStore first needs its model
+    HAS_EMBED = importlib.util.find_spec("sentence_transformers") is not None
 except Exception:
     HAS_EMBED = False
 
 DB_PATH = os.environ.get("MEMORY_DB", "memory_store.db")
 EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL", "all-MiniLM-L6-v2")  # small, fast
+# Chatbot state lives under data/ next to the DuckDB cache (git-ignored)
+CONVERSATION_DB_PATH = os.environ.get("CONVERSATION_DB", os.path.join("data", "conversations.db"))
+EMBED_BATCH_SIZE = 32  # memories embedded per encode() call
+COMMIT_EVERY = 32  # add_memory() inserts per commit; flush(), close() and exit commit any remainder
+EMBED_TORCH_THREADS = int(os.environ.get("EMBED_TORCH_THREADS", "1"))  # intra-op threads for encode()
+
+def _quantize(embs):
+    """Unit-normalized float embeddings -> int8 (x127); 4x smaller rows than float32"""
+    return np.clip(np.rint(embs * 127.0), -127, 127).astype("int8")
+
+def _decode_embedding(blob: bytes, dim: int):
+    """int8 row as stored by flush(); rows written before quantization are float32 and get quantized"""
+    if len(blob) == dim:
+        return np.frombuffer(blob, dtype="int8")
+    if len(blob) == dim * 4:
+        return _quantize(np.frombuffer(blob, dtype="float32"))
+    raise ValueError(f"embedding of {len(blob)} bytes does not match dim {dim}")
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """sqlite3 connection, creating the parent directory of the file first"""
+    parent = os.path.dirname(db_path)
+    if parent and db_path != ":memory:":
+        os.makedirs(parent, exist_ok=True)
+    return sqlite3.connect(db_path, check_same_thread=False)
 
 class MemoryStore:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn = _connect(self.db_path)
+        # WAL + NORMAL: commits append to the log instead of fsyncing the main DB each time
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA mmap_size=268435456")
+        self.conn.execute("PRAGMA cache_size=-65536")
         self._ensure_tables()
-        self.model = None
-        if HAS_EMBED:
-            try:
-                self.model = SentenceTransformer(EMBED_MODEL_NAME)
-            except Exception:
-                self.model = None
+        # inserts since the last commit (committed every COMMIT_EVERY, on flush()/close() and at exit)
+        self._uncommitted = 0
+        self._commit_every = COMMIT_EVERY
+        self._commit_lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.close)
+        # (row id, text) pairs inserted without an embedding yet; encoded together in flush()
+        self._pending: List[tuple] = []
+        self._pending_lock = threading.Lock()
+        # Resident float32 copy of all stored embeddings (rows [:_emb_count]), loaded on first search
+        self._emb_matrix = None
+        self._emb_ids: List[int] = []
+        self._emb_count = 0
+        self._matrix_lock = threading.Lock()
+        # SentenceTransformer, built on first access of .model
+        self._model = None
+        self._model_failed = False
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """Embedding model, loaded on first use; None when sentence-transformers is unavailable."""
+        if self._model is None and HAS_EMBED and not self._model_failed:
+            with self._model_lock:
+                if self._model is None and not self._model_failed:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                        try:
+                            import torch
+                            # callers already run encode() from several threads; avoid BLAS oversubscription
+                            torch.set_num_threads(EMBED_TORCH_THREADS)
+                        except Exception:
+                            pass
+                        self._model = SentenceTransformer(EMBED_MODEL_NAME)
+                    except Exception:
+                        self._model_failed = True
+        return self._model
 
     def _ensure_tables(self):
         c = self.conn.cursor()
@@ -47,7 +111,7 @@ class MemoryStore:
     def _embed(self, texts: List[str]):
         if not self.model:
             return None
-        embs = self.model.encode(texts, convert_to_numpy=True)
+        embs = self.model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
         # normalize
         norms = (embs**2).sum(axis=1, keepdims=True)**0.5
         norms[norms==0] = 1.0
@@ -55,25 +119,74 @@ class MemoryStore:
         return embs
 
     def add_memory(self, role: str, text: str, summary: str = "", meta: dict = None) -> int:
+        """Store a memory; its embedding is computed later in a batch (see flush())."""
         created_at = datetime.utcnow().isoformat()
         meta_json = json.dumps(meta or {})
-        emb_blob = None
-        if self.model:
-            try:
-                emb = self._embed([text])[0].astype("float32")
-                emb_blob = emb.tobytes()
-            except Exception:
-                emb_blob = None
 
-        c = self.conn.cursor()
-        c.execute(
-            "INSERT INTO memories (role, text, summary, meta, created_at, embedding) VALUES (?, ?, ?, ?, ?, ?)",
-            (role, text, summary or "", meta_json, created_at, emb_blob)
-        )
-        rowid = c.lastrowid
-        self.conn.commit()
+        with self._commit_lock:
+            c = self.conn.cursor()
+            c.execute(
+                "INSERT INTO memories (role, text, summary, meta, created_at, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+                (role, text, summary or "", meta_json, created_at, None)
+            )
+            rowid = c.lastrowid
+            self._uncommitted += 1
+            if self._uncommitted >= self._commit_every:
+                self.conn.commit()
+                self._uncommitted = 0
+
+        if HAS_EMBED and not self._model_failed:  # queue without forcing the model to load yet
+            with self._pending_lock:
+                self._pending.append((rowid, text))
+                full = len(self._pending) >= EMBED_BATCH_SIZE
+            if full:
+                self.flush()
         return rowid
 
+    def _commit(self):
+        """Commit inserts not yet committed by add_memory()."""
+        with self._commit_lock:
+            if self._uncommitted:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        """Commit buffered inserts and close the connection; registered with atexit, safe to call twice."""
+        if self._closed:
+            return
+        if self._model is not None:
+            # embed what is still queued; without a loaded model (e.g. nothing was searched yet) the rows
+            # keep embedding NULL and are re-queued by the next store's first search instead of loading
+            # torch at exit
+            self.flush()
+        self._commit()
+        self._closed = True
+        atexit.unregister(self.close)
+        self.conn.close()
+
+    def flush(self):
+        """Commit buffered inserts, then embed all pending memories with one encode() call
+        and store them in one transaction."""
+        self._commit()
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending or not self.model:
+            return
+        try:
+            embs = _quantize(self._embed([text for _, text in pending]))
+        except Exception:
+            # keep the batch queued for the next flush
+            with self._pending_lock:
+                self._pending[:0] = pending
+            return
+        with self._matrix_lock:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE memories SET embedding = ? WHERE id = ?",
+                    [(emb.tobytes(), rowid) for (rowid, _), emb in zip(pending, embs)]
+                )
+            self._append_to_matrix([rowid for rowid, _ in pending], embs)
+
     def list_recent(self, n: int = 20) -> List[Dict]:
         """Return recent memories ordered newest first."""
         c = self.conn.cursor()
@@ -97,39 +210,45 @@ class MemoryStore:
             # fallback: return most recent items (best-effort)
             return self.list_recent(top_k)
 
+        if self._emb_matrix is None:
+            self._requeue_unembedded()
+        # memories added since the last batch must be searchable too
+        self.flush()
+
         # compute embedding for query
         try:
             q_emb = self._embed([query])[0].astype("float32")
         except Exception:
             return self.list_recent(top_k)
+        dim = q_emb.shape[0]
 
-        # fetch all embeddings
-        c = self.conn.cursor()
-        c.execute("SELECT id, role, text, summary, meta, created_at, embedding FROM memories WHERE embedding IS NOT NULL")
-        rows = c.fetchall()
-        if not rows:
-            return self.list_recent(top_k)
+        with self._matrix_lock:
+            self._ensure_matrix(dim)
+            n = self._emb_count
+            if not n:
+                return self.list_recent(top_k)
+            # cosine similarities over the resident matrix: one sgemm, no per-query fetch or vstack
+            sims = self._emb_matrix[:n] @ q_emb
+            # O(n) selection of the top_k, then sort just those
+            k = min(top_k, n)
+            if k <= 0:
+                return []
+            part = np.argpartition(-sims, k - 1)[:k]
+            top_idx = part[np.argsort(-sims[part])]
+            winners = [(self._emb_ids[i], float(sims[i])) for i in top_idx]
 
-        ids = []
-        embs = []
-        metas = []
-        for r in rows:
-            emb_blob = r[6]
-            try:
-                arr = np.frombuffer(emb_blob, dtype="float32")
-                embs.append(arr)
-                ids.append(r[:6])
-            except Exception:
-                continue
-        if not embs:
-            return self.list_recent(top_k)
-        embs = np.vstack(embs)
-        # cosine similarities
-        sims = (embs @ q_emb).reshape(-1)
-        top_idx = sims.argsort()[::-1][:top_k]
+        # fetch only the winning rows
+        placeholders = ",".join("?" * len(winners))
+        rows = self.conn.execute(
+            f"SELECT id, role, text, summary, meta, created_at FROM memories WHERE id IN ({placeholders})",
+            [rowid for rowid, _ in winners]
+        ).fetchall()
+        by_id = {r[0]: r for r in rows}
         results = []
-        for i in top_idx:
-            row_meta = rows[i]
+        for rowid, score in winners:
+            row_meta = by_id.get(rowid)
+            if row_meta is None:
+                continue
             results.append({
                 "id": row_meta[0],
                 "role": row_meta[1],
@@ -137,12 +256,145 @@ class MemoryStore:
                 "summary": row_meta[3],
                 "meta": json.loads(row_meta[4] or "{}"),
                 "created_at": row_meta[5],
-                "score": float(sims[i])
+                "score": score
             })
         return results
 
-# singleton
+    def _requeue_unembedded(self):
+        """Queue stored rows that never got an embedding (process exited before their batch was flushed)."""
+        rows = self.conn.execute("SELECT id, text FROM memories WHERE embedding IS NULL ORDER BY id").fetchall()
+        if not rows:
+            return
+        with self._pending_lock:
+            queued = {rowid for rowid, _ in self._pending}
+            self._pending[:0] = [row for row in rows if row[0] not in queued]
+
+    def _ensure_matrix(self, dim: int):
+        """Load every stored embedding once into a float32 matrix (caller holds _matrix_lock)."""
+        if self._emb_matrix is not None:
+            return
+        rows = self.conn.execute(
+            "SELECT id, embedding FROM memories WHERE embedding IS NOT NULL ORDER BY id"
+        ).fetchall()
+        # int8 rows are fixed-width: decode them all with one frombuffer over the joined blobs
+        ids = [rowid for rowid, blob in rows if len(blob) == dim]
+        legacy = [(rowid, blob) for rowid, blob in rows if len(blob) != dim]
+        matrix = np.empty((max(len(rows), 64), dim), dtype="float32")
+        if ids:
+            joined = b"".join(blob for _, blob in rows if len(blob) == dim)
+            matrix[:len(ids)] = np.frombuffer(joined, dtype="int8").reshape(-1, dim)
+        for rowid, blob in legacy:
+            try:
+                matrix[len(ids)] = _decode_embedding(blob, dim)
+            except ValueError:
+                continue
+            ids.append(rowid)
+        matrix[:len(ids)] /= 127.0
+        self._emb_matrix, self._emb_ids, self._emb_count = matrix, ids, len(ids)
+
+    def _append_to_matrix(self, ids: List[int], embs):
+        """Append freshly stored int8 rows to the resident matrix, doubling capacity when full."""
+        if self._emb_matrix is None or embs.shape[1] != self._emb_matrix.shape[1]:
+            return
+        n = self._emb_count + len(ids)
+        if n > self._emb_matrix.shape[0]:
+            grown = np.empty((max(n, 2 * self._emb_matrix.shape[0]), embs.shape[1]), dtype="float32")
+            grown[:self._emb_count] = self._emb_matrix[:self._emb_count]
+            self._emb_matrix = grown
+        self._emb_matrix[self._emb_count:n] = embs / 127.0
+        self._emb_ids.extend(ids)
+        self._emb_count = n
+
+class ConversationStore:
+    """Chatbot turns and cached Gemini responses in SQLite.
+    WAL mode lets several Streamlit sessions read while one writes on the chat path.
+    """
+
+    def __init__(self, db_path: str = CONVERSATION_DB_PATH):
+        self.db_path = db_path
+        self.conn = _connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        c = self.conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            ts TEXT,
+            gemini_text TEXT
+        );
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations (session_id, id)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS gemini_cache (
+            prompt_hash TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL
+        );
+        """)
+        self.conn.commit()
+
+    def add_turn(self, session_id: str, turn: int, messages: List[Dict]):
+        """Insert all messages of one turn in a single transaction (one fsync)"""
+        rows = [
+            (session_id, turn, m['role'], m['content'], m.get('timestamp'), m.get('gemini_insights'))
+            for m in messages
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO conversations (session_id, turn, role, content, ts, gemini_text) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def last_turn(self, session_id: str) -> int:
+        """Highest stored turn number of a session (0 when it has none)."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT MAX(turn) FROM conversations WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] or 0
+
+    def recent_messages(self, session_id: str, n: int) -> List[Dict]:
+        """Return the last n messages of a session, oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content, ts, gemini_text FROM conversations WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, n)
+            ).fetchall()
+        results = []
+        for role, content, ts, gemini_text in reversed(rows):
+            msg = {"role": role, "content": content}
+            if gemini_text is not None:
+                msg["gemini_insights"] = gemini_text
+            if ts is not None:
+                msg["timestamp"] = ts
+            results.append(msg)
+        return results
+
+    def get_cached_response(self, prompt_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response FROM gemini_cache WHERE prompt_hash = ?", (prompt_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_cached_response(self, prompt_hash: str, prompt: str, response: str):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO gemini_cache (prompt_hash, prompt, response) VALUES (?, ?, ?)",
+                (prompt_hash, prompt, response)
+            )
+
+# singletons
 _memory_instance: Optional[MemoryStore] = None
+_conversation_store: Optional[ConversationStore] = None
 
 def get_memory() -> MemoryStore:
     global _memory_instance
@@ -150,6 +402,12 @@ def get_memory() -> MemoryStore:
         _memory_instance = MemoryStore()
     return _memory_instance
 
+def get_conversation_store() -> ConversationStore:
+    global _conversation_store
+    if _conversation_store is None:
+        _conversation_store = ConversationStore()
+    return _conversation_store
+
 if __name__ == "__main__":
     # quick test
     m = get_memory()
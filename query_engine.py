@@ -1,11 +1,16 @@
 # query_engine.py
 
+import functools
+import os
 import re
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, date
 import calendar
 from typing import List
 
-from database import get_db
+from database import DB_LOCK, get_db
 
 def _fmt_currency(v):
     try:
@@ -19,28 +24,176 @@ def _fmt_int(v):
     except Exception:
         return str(v)
 
+def _keywords(*words):
+    """Compile a substring alternation equivalent to any(w in q for w in words)"""
+    return re.compile("|".join(re.escape(w) for w in words))
+
+# (intent, patterns) checked in order; an intent matches when all of its patterns match
+_INTENT_PATTERNS = (
+    ('top_customers', (_keywords('customer', 'customers', 'lifetime revenue', 'ltv', 'top customer', 'top customers', 'repeat purchase', 'repeat rate'),)),
+    ('delivery_analysis', (_keywords('delivery', 'deliver', 'shipped', 'ship', 'fulfill', 'fulfillment'),)),
+    ('top_selling', (_keywords('highest', 'top', 'best', 'most selling', 'leading', 'popular'), _keywords('category', 'product', 'categories'))),
+    ('time_series', (_keywords('trend', 'growth', 'over time', 'monthly', 'quarterly', 'past', 'month', 'year'),)),
+    ('average_value', (_keywords('average', 'avg', 'mean', 'aov', 'average order value'),)),
+    ('total_value', (_keywords('total', 'sum', 'all', 'overall', 'total revenue'),)),
+    ('count', (_keywords('count', 'how many', 'number of'),)),
+    ('payment_analysis', (_keywords('payment', 'method', 'installment', 'pay'),)),
+    ('geographic', (_keywords('state', 'location', 'city', 'region', 'geographic', 'where'),)),
+    ('order_status', (_keywords('status', 'cancelled', 'canceled', 'delivered', 'pending'),)),
+)
+
+QUERY_HISTORY_MAXLEN = int(os.environ.get('CHAT_HISTORY_LIMIT', '200'))
+SQL_PLAN_CACHE_SIZE = 1024
+# Rows per (sql, bind); the loaded CSVs don't change while the app runs, the TTL just bounds staleness
+SQL_RESULT_CACHE_SIZE = 256
+SQL_RESULT_CACHE_TTL = 600  # seconds
+# (sql, bind) -> (stored_at, rows as a tuple); process-wide because every engine queries the
+# same get_db() connection, so a result computed for one session is valid for all of them
+_SQL_RESULT_CACHE = OrderedDict()
+_SQL_RESULT_CACHE_LOCK = threading.Lock()
+
+# 'count' intent: first keyword found in the query picks the statement; these exact strings
+# are also the result-cache keys, so every phrasing of a count question reuses one entry
+_COUNT_SQL = (
+    ('customer', "SELECT 'Total Customers' as metric, COUNT(DISTINCT customer_id) as count FROM orders"),
+    ('order', "SELECT 'Total Orders' as metric, COUNT(*) as count FROM orders"),
+    ('product', "SELECT 'Total Products' as metric, COUNT(DISTINCT product_id) as count FROM products"),
+)
+_COUNT_SQL_DEFAULT = _COUNT_SQL[1][1]
+
+# Aggregates for the undated top_selling / average_value / geographic / top_customers questions,
+# built once per connection so those intents read pre-grouped rows instead of re-joining order_items
+_SUMMARY_TABLES = (
+    ('category_summary', """
+SELECT
+  COALESCE(p.product_category_name, 'Unknown') as category,
+  COUNT(DISTINCT oi.order_id) as orders,
+  ROUND(SUM(COALESCE(oi.price, 0)), 2) as revenue,
+  ROUND(AVG(COALESCE(oi.price, 0)), 2) as avg_value
+FROM products p
+JOIN order_items oi ON p.product_id = oi.product_id
+GROUP BY p.product_category_name
+"""),
+    ('state_summary', """
+SELECT
+  COALESCE(c.customer_state, 'Unknown') as state,
+  COUNT(DISTINCT o.order_id) as orders,
+  ROUND(SUM(COALESCE(oi.price, 0)), 2) as revenue
+FROM customers c
+JOIN orders o ON c.customer_id = o.customer_id
+JOIN order_items oi ON o.order_id = oi.order_id
+GROUP BY c.customer_state
+"""),
+    ('customer_summary', """
+SELECT
+  o.customer_id,
+  COUNT(DISTINCT o.order_id) AS orders,
+  ROUND(SUM(COALESCE(oi.price, 0)), 2) AS lifetime_revenue,
+  ROUND( CASE WHEN COUNT(DISTINCT o.order_id) > 0 THEN (COUNT(DISTINCT o.order_id) - 1) * 1.0 / COUNT(DISTINCT o.order_id) ELSE 0 END * 100.0, 2) AS repeat_purchase_pct
+FROM orders o
+JOIN order_items oi ON o.order_id = oi.order_id
+GROUP BY o.customer_id
+"""),
+)
+
+_TOP_N_RE = re.compile(r'top\s*(\d+)')
+_QUARTERS_RE = re.compile(r'(\d+)\s*quarters?')
+_MONTHS_RE = re.compile(r'(\d+)\s*months?')
+_CLEAN_RE = re.compile(r'[^\w\s?-]', re.UNICODE)
+_CATEGORY_RE = re.compile(r'(electronics|beauty|sports|home|fashion|books|toys|informatica)')
+
+# keyword -> parameter value, first match wins (most specific first: city over state over
+# category, price over rating over revenue); matched as substrings like the intent keywords
+_PERIOD_WORDS = (('quarter', 3), ('year', 12))
+_DIMENSION_WORDS = (('city', 'city'), ('state', 'state'), ('category', 'category'))
+_METRIC_WORDS = (('price', 'price'), ('rating', 'rating'), ('review', 'rating'), ('revenue', 'revenue'), ('sales', 'revenue'))
+
+@functools.lru_cache(maxsize=512)
+def _classify_intent_cached(query: str) -> str:
+    """Intent for an already-cleaned query (pure function of the string, so memoized)"""
+    for intent, patterns in _INTENT_PATTERNS:
+        if all(p.search(query) for p in patterns):
+            return intent
+    return 'top_selling'
+
+@functools.lru_cache(maxsize=512)
+def _extract_parameters_cached(query: str) -> tuple:
+    """Parameters for an already-cleaned query as (key, value) pairs (hashable, so memoized)"""
+    q = query
+    params = {}
+    m = _TOP_N_RE.search(q)
+    if m:
+        try:
+            params['top_n'] = int(m.group(1))
+        except Exception:
+            pass
+    if 'top customers' in q and 'top_n' not in params:
+        params['top_n'] = 10
+    m_q = _QUARTERS_RE.search(q)
+    if m_q:
+        params['months_back'] = int(m_q.group(1)) * 3
+    m_m = _MONTHS_RE.search(q)
+    if m_m:
+        params['months_back'] = int(m_m.group(1))
+    if 'months_back' not in params:
+        months = next((m for word, m in _PERIOD_WORDS if word in q), None)
+        if months is not None:
+            params['months_back'] = months
+    for key, table in (('dimension', _DIMENSION_WORDS), ('metric', _METRIC_WORDS)):
+        value = next((v for word, v in table if word in q), None)
+        if value is not None:
+            params[key] = value
+    return tuple(params.items())
+
 class IntelligentQueryEngine:
     """Natural Language Query Engine - robust date handling via Python computed DATE literals"""
 
     def __init__(self):
         self.db = get_db()
-        self.conversation_history = []
+        # Recent queries only; the engine never reads old entries back
+        self.conversation_history = deque(maxlen=QUERY_HISTORY_MAXLEN)
+        # DuckDB connections are not safe for concurrent execute(); every engine shares get_db()'s
+        # connection (and its temp summary tables), so they all serialize on the module-wide lock
+        self._db_lock = DB_LOCK
+        # Repeat questions skip classification, parameter extraction and SQL generation
+        self._plan = functools.lru_cache(maxsize=SQL_PLAN_CACHE_SIZE)(self._build_plan)
+        # Different phrasings (and different engines) that plan to the same SQL share an entry
+        self._result_cache = _SQL_RESULT_CACHE
+        self._result_cache_lock = _SQL_RESULT_CACHE_LOCK
+        self._summaries = self._materialize_summaries()
 
-    def _months_ago_date(self, months_back: int) -> str:
+    def _materialize_summaries(self) -> frozenset:
+        """Create the _SUMMARY_TABLES as temp tables (once per connection); returns the ones available.
+        A summary whose source tables are missing is skipped and its intents keep the join SQL.
+        """
+        available = set()
+        with self._db_lock:
+            for name, select in _SUMMARY_TABLES:
+                try:
+                    self.db.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} AS {select}")
+                    available.add(name)
+                except Exception as e:
+                    print(f"⚠️ Summary table {name} unavailable: {str(e)[:80]}")
+        return frozenset(available)
+
+    def _months_ago_date(self, months_back: int, today: date = None) -> str:
         """Return an ISO date string ('YYYY-MM-DD') for the first day of the month 'months_back' months ago.
         Use dateutil.relativedelta when available for correctness; otherwise fallback to safe manual math.
         We return the first day of that month to avoid day-of-month validity issues.
+        Callers compare it as a TIMESTAMP (midnight) rather than casting the column to DATE, which is
+        equivalent and keeps the filter prunable on the sorted orders Parquet.
+        `today` defaults to the current UTC date; query_with_intent() passes the date of its own clock read.
         """
+        if today is None:
+            today = datetime.utcnow().date()
         # Prefer dateutil if installed for correctness
         try:
             from dateutil.relativedelta import relativedelta  # type: ignore
-            today = datetime.utcnow().date()
             target = today - relativedelta(months=months_back)
             # Use first day of that month for stable windowing
             return date(target.year, target.month, 1).isoformat()
         except Exception:
             # Manual fallback
-            today = datetime.utcnow().date()
             year = today.year
             month = today.month - months_back
             # Adjust year/month rollover
@@ -57,91 +210,77 @@ class IntelligentQueryEngine:
 
     def query(self, natural_language_query: str) -> dict:
         """Main entry point: accept NL query, classify, generate SQL, run, format response"""
+        return self.query_with_intent(natural_language_query)[2]
+
+    def query_with_intent(self, natural_language_query: str) -> tuple:
+        """Like query(), but also return the classified intent and params: (intent, params, response).
+        Callers that need the intent should use this instead of re-classifying the message themselves.
+        """
         query_clean = self._clean_query(natural_language_query)
+        now = time.time()
+        self.record_query(query_clean, now)
+        return self._run_clean(query_clean, now)
+
+    def record_query(self, query_clean: str, now: float = None):
+        """Append a user query to conversation_history (callers answering from their own cache use this)"""
         self.conversation_history.append({
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': time.time() if now is None else now,
             'query': query_clean,
             'type': 'user'
         })
 
+    def run_silent(self, natural_language_query: str) -> tuple:
+        """Same as query_with_intent() but without recording the query in conversation_history.
+        For warm-up/prefetch callers whose queries the user never asked.
+        """
+        return self._run_clean(self._clean_query(natural_language_query), time.time())
+
+    def _run_clean(self, query_clean: str, now: float) -> tuple:
+        """Plan, execute and format an already-cleaned query: (intent, params, response)."""
+        intent, params = None, {}
         try:
-            intent = self._classify_intent(query_clean)
-            params = self._extract_parameters(query_clean)
-            sql_query = self._generate_sql(intent, params, query_clean)
-            result = self._execute_query(sql_query)
+            intent, param_items, sql_query, bind = self._plan(query_clean, datetime.utcfromtimestamp(now).date())
+            params = dict(param_items)
+            result = self._execute_query(sql_query, bind)
             response = self._format_response(result, intent, params, query_clean, sql_query)
-            return response
+            return intent, params, response
         except Exception as e:
-            return self._handle_error(str(e), query_clean)
+            return intent, params, self._handle_error(str(e), query_clean)
+
+    def _build_plan(self, query_clean: str, today: date) -> tuple:
+        """(intent, params as (key, value) pairs, sql, bind values) for a cleaned query.
+        `today` is part of the cache key because the SQL embeds date cutoffs computed from it.
+        """
+        intent = self._classify_intent(query_clean)
+        params = self._extract_parameters(query_clean)
+        sql, bind = self._generate_sql(intent, params, query_clean, today)
+        return intent, tuple(params.items()), sql, bind
 
     def _clean_query(self, query: str) -> str:
-        query = re.sub(r'[^\w\s?-]', '', query, flags=re.UNICODE)
-        return query.strip().lower()
+        return _CLEAN_RE.sub('', query).strip().lower()
 
     def _classify_intent(self, query: str) -> str:
-        q = query.lower()
-        if any(term in q for term in ['customer', 'customers', 'lifetime revenue', 'ltv', 'top customer', 'top customers', 'repeat purchase', 'repeat rate']):
-            return 'top_customers'
-        if any(w in q for w in ['delivery', 'deliver', 'shipped', 'ship', 'fulfill', 'fulfillment']):
-            return 'delivery_analysis'
-        if any(w in q for w in ['highest', 'top', 'best', 'most selling', 'leading', 'popular']) and any(w in q for w in ['category', 'product', 'categories']):
-            return 'top_selling'
-        if any(w in q for w in ['trend', 'growth', 'over time', 'monthly', 'quarterly', 'past', 'month', 'year']):
-            return 'time_series'
-        if any(w in q for w in ['average', 'avg', 'mean', 'aov', 'average order value']):
-            return 'average_value'
-        if any(w in q for w in ['total', 'sum', 'all', 'overall', 'total revenue']):
-            return 'total_value'
-        if any(w in q for w in ['count', 'how many', 'number of']):
-            return 'count'
-        if any(w in q for w in ['payment', 'method', 'installment', 'pay']):
-            return 'payment_analysis'
-        if any(w in q for w in ['state', 'location', 'city', 'region', 'geographic', 'where']):
-            return 'geographic'
-        if any(w in q for w in ['status', 'cancelled', 'canceled', 'delivered', 'pending']):
-            return 'order_status'
-        return 'top_selling'
+        return _classify_intent_cached(query.lower().strip())
 
     def _extract_parameters(self, query: str) -> dict:
-        q = query.lower()
-        params = {}
-        m = re.search(r'top\s*(\d+)', q)
-        if m:
-            try:
-                params['top_n'] = int(m.group(1))
-            except Exception:
-                pass
-        if 'top customers' in q and 'top_n' not in params:
-            params['top_n'] = 10
-        m_q = re.search(r'(\d+)\s*quarters?', q)
-        if m_q:
-            params['months_back'] = int(m_q.group(1)) * 3
-        m_m = re.search(r'(\d+)\s*months?', q)
-        if m_m:
-            params['months_back'] = int(m_m.group(1))
-        if 'quarter' in q and 'months_back' not in params:
-            params['months_back'] = 3
-        if 'year' in q and 'months_back' not in params:
-            params['months_back'] = 12
-        if 'category' in q:
-            params['dimension'] = 'category'
-        if 'state' in q:
-            params['dimension'] = 'state'
-        if 'city' in q:
-            params['dimension'] = 'city'
-        if 'revenue' in q or 'sales' in q:
-            params['metric'] = 'revenue'
-        if 'rating' in q or 'review' in q:
-            params['metric'] = 'rating'
-        if 'price' in q:
-            params['metric'] = 'price'
-        return params
+        # Fresh dict per call so callers can't mutate the cached entry
+        return dict(_extract_parameters_cached(query.lower().strip()))
 
-    def _generate_sql(self, intent: str, params: dict, original_query: str) -> str:
+    def _generate_sql(self, intent: str, params: dict, original_query: str, today: date = None) -> tuple:
+        """Return (sql, bind values). Variable parts are ? placeholders, so each intent has a
+        fixed SQL text and DuckDB can reuse the statement it prepared for it.
+        """
         # TOP CUSTOMERS
         if intent == 'top_customers':
             top_n = params.get('top_n', 10)
-            return f"""
+            if 'customer_summary' in self._summaries:
+                return """
+SELECT customer_id, orders, lifetime_revenue, repeat_purchase_pct
+FROM customer_summary
+ORDER BY lifetime_revenue DESC
+LIMIT ?
+""", (top_n,)
+            return """
 SELECT
   o.customer_id,
   COUNT(DISTINCT o.order_id) AS orders,
@@ -151,28 +290,33 @@ FROM orders o
 JOIN order_items oi ON o.order_id = oi.order_id
 GROUP BY o.customer_id
 ORDER BY lifetime_revenue DESC
-LIMIT {top_n}
-"""
+LIMIT ?
+""", (top_n,)
         # DELIVERY
         if intent == 'delivery_analysis':
+            # one scan of orders; the single aggregate row is fanned out to (metric, value) rows
             return """
-SELECT 'Total Delivered Orders' as metric, COUNT(*) as value
-FROM orders
-WHERE order_delivered_customer_date IS NOT NULL
-UNION ALL
-SELECT 'Total Orders' as metric, COUNT(*) as value
-FROM orders
-UNION ALL
-SELECT 'Delivery Rate %' as metric,
-  ROUND(CAST(COUNT(CASE WHEN order_delivered_customer_date IS NOT NULL THEN 1 END) AS FLOAT) * 100.0 / NULLIF(COUNT(*),0), 1) as value
-FROM orders
-"""
+WITH s AS (
+  SELECT
+    COUNT(*) FILTER (WHERE order_delivered_customer_date IS NOT NULL) as delivered,
+    COUNT(*) as total
+  FROM orders
+)
+SELECT m.metric,
+  CASE m.k
+    WHEN 1 THEN s.delivered
+    WHEN 2 THEN s.total
+    ELSE ROUND(CAST(s.delivered AS FLOAT) * 100.0 / NULLIF(s.total, 0), 1)
+  END as value
+FROM s, (VALUES (1, 'Total Delivered Orders'), (2, 'Total Orders'), (3, 'Delivery Rate %')) m(k, metric)
+ORDER BY m.k
+""", ()
         # TOP SELLING WITH PYTHON-COMPUTED DATE LITERAL
         if intent == 'top_selling':
             if params.get('months_back'):
                 months = int(params['months_back'])
-                cutoff = self._months_ago_date(months)
-                return f"""
+                cutoff = self._months_ago_date(months, today)
+                return """
 SELECT
   COALESCE(p.product_category_name, 'Unknown') as category,
   COUNT(DISTINCT oi.order_id) as orders,
@@ -180,12 +324,14 @@ SELECT
 FROM products p
 JOIN order_items oi ON p.product_id = oi.product_id
 JOIN orders o ON oi.order_id = o.order_id
-WHERE CAST(o.order_purchase_timestamp AS DATE) >= DATE '{cutoff}'
+WHERE CAST(o.order_purchase_timestamp AS TIMESTAMP) >= CAST(? AS TIMESTAMP)
 GROUP BY p.product_category_name
 ORDER BY revenue DESC
 LIMIT 10
-"""
+""", (cutoff,)
             else:
+                if 'category_summary' in self._summaries:
+                    return "SELECT category, orders, revenue FROM category_summary ORDER BY revenue DESC LIMIT 10", ()
                 return """
 SELECT
   COALESCE(p.product_category_name, 'Unknown') as category,
@@ -196,41 +342,43 @@ JOIN order_items oi ON p.product_id = oi.product_id
 GROUP BY p.product_category_name
 ORDER BY revenue DESC
 LIMIT 10
-"""
+""", ()
         # TIME SERIES (monthly revenue)
         if intent == 'time_series':
             months = params.get('months_back', 12)
-            cutoff = self._months_ago_date(months)
-            return f"""
+            cutoff = self._months_ago_date(months, today)
+            return """
 SELECT
   DATE_TRUNC('month', CAST(o.order_purchase_timestamp AS TIMESTAMP))::DATE as period,
   COUNT(DISTINCT o.order_id) as orders,
   ROUND(SUM(COALESCE(oi.price, 0)), 2) as revenue
 FROM orders o
 JOIN order_items oi ON o.order_id = oi.order_id
-WHERE CAST(o.order_purchase_timestamp AS DATE) >= DATE '{cutoff}'
+WHERE CAST(o.order_purchase_timestamp AS TIMESTAMP) >= CAST(? AS TIMESTAMP)
 GROUP BY DATE_TRUNC('month', CAST(o.order_purchase_timestamp AS TIMESTAMP))::DATE
 ORDER BY period DESC
-LIMIT {months}
-"""
+LIMIT ?
+""", (cutoff, int(months))
         # AVERAGE VALUE
         if intent == 'average_value':
-            category_match = re.search(r'(electronics|beauty|sports|home|fashion|books|toys|informatica)', original_query.lower())
+            category_match = _CATEGORY_RE.search(original_query.lower())
             if category_match:
                 category = category_match.group(1)
-                return f"""
+                return """
 SELECT
   COALESCE(p.product_category_name, 'Unknown') as category,
   ROUND(AVG(COALESCE(oi.price, 0)), 2) as avg_value,
   COUNT(DISTINCT oi.order_id) as orders
 FROM products p
 JOIN order_items oi ON p.product_id = oi.product_id
-WHERE LOWER(p.product_category_name) LIKE '%{category}%'
+WHERE LOWER(p.product_category_name) LIKE ?
 GROUP BY p.product_category_name
 ORDER BY avg_value DESC
 LIMIT 10
-"""
+""", (f"%{category}%",)
             else:
+                if 'category_summary' in self._summaries:
+                    return "SELECT category, avg_value, orders FROM category_summary ORDER BY avg_value DESC LIMIT 10", ()
                 return """
 SELECT
   COALESCE(p.product_category_name, 'Unknown') as category,
@@ -241,27 +389,30 @@ JOIN order_items oi ON p.product_id = oi.product_id
 GROUP BY p.product_category_name
 ORDER BY avg_value DESC
 LIMIT 10
-"""
+""", ()
         # TOTAL / COUNT / PAYMENT / GEOGRAPHIC / ORDER_STATUS -- unchanged templates
         if intent == 'total_value':
+            # one aggregate per source table (orders scanned once for both of its metrics)
             return """
-SELECT 'Total Orders' as metric, CAST(COUNT(*) AS VARCHAR) as value FROM orders
-UNION ALL
-SELECT 'Total Revenue (R$)' as metric, CAST(ROUND(SUM(COALESCE(price, 0)), 2) AS VARCHAR) FROM order_items
-UNION ALL
-SELECT 'Total Customers' as metric, CAST(COUNT(DISTINCT customer_id) AS VARCHAR) FROM orders
-UNION ALL
-SELECT 'Total Products' as metric, CAST(COUNT(DISTINCT product_id) AS VARCHAR) FROM products
-"""
+WITH o AS (SELECT COUNT(*) as orders, COUNT(DISTINCT customer_id) as customers FROM orders),
+  oi AS (SELECT ROUND(SUM(COALESCE(price, 0)), 2) as revenue FROM order_items),
+  p AS (SELECT COUNT(DISTINCT product_id) as products FROM products)
+SELECT m.metric,
+  CASE m.k
+    WHEN 1 THEN CAST(o.orders AS VARCHAR)
+    WHEN 2 THEN CAST(oi.revenue AS VARCHAR)
+    WHEN 3 THEN CAST(o.customers AS VARCHAR)
+    ELSE CAST(p.products AS VARCHAR)
+  END as value
+FROM o, oi, p,
+  (VALUES (1, 'Total Orders'), (2, 'Total Revenue (R$)'), (3, 'Total Customers'), (4, 'Total Products')) m(k, metric)
+ORDER BY m.k
+""", ()
         if intent == 'count':
-            if 'customer' in original_query:
-                return "SELECT 'Total Customers' as metric, COUNT(DISTINCT customer_id) as count FROM orders"
-            elif 'order' in original_query:
-                return "SELECT 'Total Orders' as metric, COUNT(*) as count FROM orders"
-            elif 'product' in original_query:
-                return "SELECT 'Total Products' as metric, COUNT(DISTINCT product_id) as count FROM products"
-            else:
-                return "SELECT 'Total Orders' as metric, COUNT(*) as count FROM orders"
+            for keyword, sql in _COUNT_SQL:
+                if keyword in original_query:
+                    return sql, ()
+            return _COUNT_SQL_DEFAULT, ()
         if intent == 'payment_analysis':
             return """
 SELECT
@@ -271,8 +422,10 @@ SELECT
 FROM payments
 GROUP BY payment_type
 ORDER BY total_orders DESC
-"""
+""", ()
         if intent == 'geographic':
+            if 'state_summary' in self._summaries:
+                return "SELECT state, orders, revenue FROM state_summary ORDER BY orders DESC LIMIT 15", ()
             return """
 SELECT
   COALESCE(c.customer_state, 'Unknown') as state,
@@ -284,17 +437,17 @@ JOIN order_items oi ON o.order_id = oi.order_id
 GROUP BY c.customer_state
 ORDER BY orders DESC
 LIMIT 15
-"""
+""", ()
         if intent == 'order_status':
             return """
 SELECT
   COALESCE(order_status, 'Unknown') as status,
   COUNT(*) as order_count,
-  ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM orders), 1) as percentage
+  ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 1) as percentage
 FROM orders
 GROUP BY order_status
 ORDER BY order_count DESC
-"""
+""", ()
         # default fallback
         return """
 SELECT
@@ -306,16 +459,33 @@ LEFT JOIN order_items oi ON p.product_id = oi.product_id
 GROUP BY p.product_category_name
 ORDER BY revenue DESC
 LIMIT 10
-"""
+""", ()
 
-    def _execute_query(self, sql: str) -> List[tuple]:
+    def _execute_query(self, sql: str, bind: tuple = ()) -> List[tuple]:
+        key = (sql, bind)
+        now = time.monotonic()
+        with self._result_cache_lock:
+            entry = self._result_cache.get(key)
+            if entry is not None:
+                stored_at, rows = entry
+                if now - stored_at < SQL_RESULT_CACHE_TTL:
+                    self._result_cache.move_to_end(key)
+                    return list(rows)
+                del self._result_cache[key]
         try:
-            result = self.db.execute(sql).fetchall()
-            return result if result else []
+            with self._db_lock:
+                result = self.db.execute(sql, bind).fetchall()
         except Exception as e:
             print("SQL Execution Error:", e)
-            print("SQL:", sql)
+            print("SQL:", sql, "| params:", bind)
             raise Exception(f"Database query failed: {str(e)}")
+        # rows are tuples of scalars, so a tuple copy is enough to keep callers from mutating the entry
+        with self._result_cache_lock:
+            self._result_cache[key] = (now, tuple(result))
+            self._result_cache.move_to_end(key)
+            while len(self._result_cache) > SQL_RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+        return result if result else []
 
     def _format_response(self, result: List[tuple], intent: str, params: dict, original_query: str, sql: str) -> dict:
         if not result or len(result) == 0:
@@ -1,9 +1,17 @@
 # tools.py 
 
-import pandas as pd
-from database import get_db
+from database import DB_LOCK, get_db
 from datetime import datetime, date
 import calendar
+import time
+
+# Tool output cache: (tool name, inputs) -> (stored_at, markdown); the loaded data is static
+_TTL = 300  # seconds
+_RESULT_CACHE = {}
+
+def clear_tool_cache():
+    """Drop cached tool results (e.g. after reloading the data folder)"""
+    _RESULT_CACHE.clear()
 
 def _months_ago_date(months_back: int) -> str:
     try:
@@ -20,11 +28,10 @@ def _months_ago_date(months_back: int) -> str:
             year -= 1
         return date(year, month, 1).isoformat()
 
-def query_sales_trends() -> str:
-    """Monthly sales trends with Python-computed cutoff (12 months)"""
-    db = get_db()
-    cutoff = _months_ago_date(12)
-    query = f"""
+# Monthly totals over all history, built once per connection. Cutoffs are always the first of a
+# month, so filtering the rollup by period gives the same rows as filtering the raw orders.
+_MONTHLY_ROLLUP_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS monthly_sales_rollup AS
 SELECT
   DATE_TRUNC('month', CAST(o.order_purchase_timestamp AS TIMESTAMP))::DATE as period,
   COUNT(DISTINCT o.order_id) as total_orders,
@@ -32,11 +39,43 @@ SELECT
   ROUND(AVG(COALESCE(oi.price, 0)), 2) as avg_order_value
 FROM orders o
 JOIN order_items oi ON o.order_id = oi.order_id
-WHERE CAST(o.order_purchase_timestamp AS DATE) >= DATE '{cutoff}'
+WHERE o.order_purchase_timestamp IS NOT NULL
 GROUP BY DATE_TRUNC('month', CAST(o.order_purchase_timestamp AS TIMESTAMP))::DATE
+"""
+
+# Module-level so every call sends the identical statement; only the bound cutoff changes
+_SALES_TREND_SQL = """
+SELECT period, total_orders, total_revenue, avg_order_value
+FROM monthly_sales_rollup
+WHERE period >= CAST(? AS DATE)
 ORDER BY period DESC
 LIMIT 12
-    """
-    result = db.execute(query).fetchall()
-    df = pd.DataFrame(result, columns=['Period', 'Orders', 'Revenue (R$)', 'AOV (R$)'])
-    return df.to_markdown(index=False)
\ No newline at end of file
+"""
+
+_rollup_ready = False
+
+def _ensure_monthly_rollup(db):
+    """Build monthly_sales_rollup on first use"""
+    global _rollup_ready
+    if not _rollup_ready:
+        db.execute(_MONTHLY_ROLLUP_SQL)
+        _rollup_ready = True
+
+def query_sales_trends() -> str:
+    """Monthly sales trends with Python-computed cutoff (12 months)"""
+    db = get_db()
+    cutoff = _months_ago_date(12)
+    key = ('query_sales_trends', cutoff)
+    entry = _RESULT_CACHE.get(key)
+    if entry is not None and time.monotonic() - entry[0] < _TTL:
+        return entry[1]
+    with DB_LOCK:
+        _ensure_monthly_rollup(db)
+        result = db.execute(_SALES_TREND_SQL, [cutoff]).fetchall()
+    # 12 rows at most: format the markdown table directly (no DataFrame/tabulate)
+    lines = ["| Period | Orders | Revenue (R$) | AOV (R$) |", "|---|---|---|---|"]
+    for period, orders, revenue, aov in result:
+        lines.append(f"| {period} | {orders} | {revenue} | {aov} |")
+    markdown = "\n".join(lines)
+    _RESULT_CACHE[key] = (time.monotonic(), markdown)
+    return markdown
\ No newline at end of file